@@ -0,0 +1,58 @@
+"""
+compares NHWC and NCHW forward latency of architecture_fn on cpu.
+weights are initialized once in NHWC and restored into the NCHW graph to check that checkpoints are compatible
+
+usage: python -m benchmarks.bench_data_format --sizes 512x512 1024x1024 --batch_size 1 --threads 0
+"""
+from benchmarks.common import ForwardOnly, bench_config, session_config, time_forward, print_table
+import numpy as np
+import tensorflow as tf
+import argparse
+import os
+import tempfile
+
+
+def build(data_format, threads):
+    graph = tf.Graph()
+    with graph.as_default():
+        model = ForwardOnly(bench_config(data_format=data_format))
+        saver = tf.train.Saver()
+        init_fn = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
+    sess = tf.Session(graph=graph, config=session_config(threads, threads))
+    sess.run(init_fn)
+    return model, saver, sess
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--sizes', type=str, nargs='+', default=['512x512', '1024x1024'], help='heightxwidth')
+    argparser.add_argument('--batch_size', type=int, default=1)
+    argparser.add_argument('--threads', type=int, default=0, help='intra/inter-op threads. 0 for tensorflow default')
+    argparser.add_argument('--repeat', type=int, default=10)
+    args = argparser.parse_args()
+
+    models = {data_format: build(data_format, args.threads) for data_format in ["NHWC", "NCHW"]}
+    ckpt_path = os.path.join(tempfile.mkdtemp(), "model_step-0")
+    models["NHWC"][1].save(models["NHWC"][2], ckpt_path, write_meta_graph=False)
+    models["NCHW"][1].restore(models["NCHW"][2], ckpt_path)
+
+    rows = []
+    for size in args.sizes:
+        height, width = [int(length) for length in size.split("x")]
+        images = np.random.randint(0, 256, [args.batch_size, height, width, 3], np.uint8)
+        preds = dict()
+        row = [size, args.batch_size]
+        for data_format, (model, _, sess) in models.items():
+            try:
+                preds[data_format] = sess.run(model.pred, {model.input_data: images})
+                row.append("%.4f" % time_forward(sess, model, args.batch_size, height, width, repeat=args.repeat))
+            except (tf.errors.InvalidArgumentError, tf.errors.UnimplementedError) as error:
+                # stock cpu builds have no NCHW conv kernels. MKL-enabled builds do
+                print("%s is not supported on this build: %s" % (data_format, error.message.splitlines()[0]))
+                row.append("n/a")
+        if len(preds) == 2:
+            row.append("%.6f" % np.mean(preds["NHWC"] == preds["NCHW"]))
+        else:
+            row.append("n/a")
+        rows.append(row)
+    print_table(["size", "batch", "NHWC sec", "NCHW sec", "mask agreement"], rows)
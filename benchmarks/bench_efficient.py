@@ -0,0 +1,40 @@
+"""
+compares the dense model with the efficient variants: FLOPs, parameters, cpu latency and mIoU
+
+mIoU is read from the last row of the metric_overall.csv that phase=eval wrote for each trained variant.
+usage: python -m benchmarks.bench_efficient --size 512x512 --eval_logs dense=a/metric_overall.csv separable=b/metric_overall.csv
+"""
+from benchmarks.common import ForwardOnly, bench_config, session_config, time_forward, print_table, count_params, count_flops
+import tensorflow as tf
+import argparse
+
+
+def read_miou(log_path):
+    with open(log_path) as reader:
+        rows = [row.strip() for row in reader.readlines() if row.strip()]
+    return rows[-1].split(",")[-1].strip()
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--size', type=str, default='512x512', help='heightxwidth')
+    argparser.add_argument('--threads', type=int, default=0, help='intra/inter-op threads. 0 for tensorflow default')
+    argparser.add_argument('--min_kernel', type=int, default=7, help='efficient_min_kernel')
+    argparser.add_argument('--eval_logs', type=str, nargs='*', default=[], help='variant=path of metric_overall.csv')
+    args = argparser.parse_args()
+
+    height, width = [int(length) for length in args.size.split("x")]
+    eval_logs = dict(entry.split("=", 1) for entry in args.eval_logs)
+    rows = []
+    for variant in ["dense", "separable", "dilated"]:
+        config = bench_config(efficient=False if variant == "dense" else variant, efficient_min_kernel=args.min_kernel)
+        graph = tf.Graph()
+        with graph.as_default():
+            model = ForwardOnly(config, [1, height, width, 3])
+            init_fn = tf.global_variables_initializer()
+        with tf.Session(graph=graph, config=session_config(args.threads, args.threads)) as sess:
+            sess.run(init_fn)
+            latency = time_forward(sess, model, 1, height, width)
+        miou = read_miou(eval_logs[variant]) if variant in eval_logs else "n/a"
+        rows.append([variant, "%.2f" % (count_flops(graph) / 1e9), count_params(graph), "%.4f" % latency, miou])
+    print_table(["variant", "GFLOPs", "params", "cpu sec", "miou"], rows)
@@ -0,0 +1,82 @@
+from functions.project_fn.model_handler import ModelHandler
+from bunch import Bunch
+import numpy as np
+import tensorflow as tf
+import time
+
+
+def bench_config(**kwargs):
+    """
+    minimal inference config to build architecture_fn without a config file. kwargs override the defaults
+    """
+    config = {"phase": "bench",
+              "is_train": False,
+              "dtype": "fp32",
+              "num_classes": 2,
+              "weight_decay": None,
+              "device": "/CPU:0",
+              "data_format": "NHWC",
+              "efficient": False,
+              "efficient_min_kernel": 7,
+              "tta": None}
+    config.update(kwargs)
+    return Bunch(config)
+
+
+class ForwardOnly(ModelHandler):
+    """
+    builds architecture_fn on a uint8 placeholder without a data pipeline or a session
+
+    input_shape: [batch, height, width, 3] for a static input shape. None for dynamic
+    """
+
+    def __init__(self, config, input_shape=None):
+        self.config = config
+        self.num_classes = config.num_classes
+        self.dtype = tf.float16 if self.config.dtype == "fp16" else tf.float32
+        self.data_format = self.config.data_format
+        self.tta = self.config.tta
+        self.pruned_arch = None
+        self.input_data = tf.placeholder(tf.uint8, input_shape or [None, None, None, 3], name="input_data")
+        self.gt = None
+        self.height = None
+        self.width = None
+        self.architecture_fn()
+        self.pred = tf.argmax(self.logit, 3)
+
+
+def session_config(intra_op_threads=0, inter_op_threads=0):
+    return tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                          inter_op_parallelism_threads=inter_op_threads,
+                          allow_soft_placement=True)
+
+
+def time_forward(sess, model, batch_size, height, width, warmup=2, repeat=10):
+    """
+    mean seconds of a forward pass on random images
+    """
+    images = np.random.randint(0, 256, [batch_size, height, width, 3], np.uint8)
+    for _ in range(warmup):
+        sess.run(model.pred, {model.input_data: images})
+    start_time = time.time()
+    for _ in range(repeat):
+        sess.run(model.pred, {model.input_data: images})
+    return (time.time() - start_time) / repeat
+
+
+def print_table(header, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(value).rjust(width) for value, width in zip(row, widths)))
+
+
+def count_params(graph):
+    with graph.as_default():
+        return int(sum(np.prod(variable.get_shape().as_list()) for variable in tf.trainable_variables()))
+
+
+def count_flops(graph):
+    # needs a graph built with a static input shape
+    options = tf.profiler.ProfileOptionBuilder.float_operation()
+    options["output"] = "none"
+    return tf.profiler.profile(graph, options=options).total_float_ops
@@ -0,0 +1,98 @@
+"""
+per-scope cost profile of architecture_fn on cpu: parameters, FLOPs, activation memory and measured time.
+writes a sortable csv and a chrome trace (open chrome://tracing and load the json)
+
+usage: python -m benchmarks.profile_architecture --size 512x512 --depth 2 --sort time_ms
+"""
+from benchmarks.common import ForwardOnly, bench_config, session_config, print_table
+from tensorflow.python.client import timeline
+from tensorflow.python.framework import ops
+from collections import defaultdict
+import numpy as np
+import tensorflow as tf
+import argparse
+import os
+
+COLUMNS = ["params", "mflops", "activation_mb", "time_ms"]
+
+
+def scope_of(name, depth):
+    # fp32_var/encoder4/... is grouped as fp32_var/encoder4 with depth=2
+    return "/".join(name.split("/")[:depth])
+
+
+def static_costs(graph, depth):
+    costs = defaultdict(lambda: dict.fromkeys(COLUMNS, 0.0))
+    with graph.as_default():
+        for variable in tf.trainable_variables():
+            costs[scope_of(variable.op.name, depth)]["params"] += np.prod(variable.get_shape().as_list())
+    for op in graph.get_operations():
+        try:
+            flops = ops.get_stats_for_node_def(graph, op.node_def, "flops").value
+        except ValueError:
+            flops = None  # no shape information or no registered statistics
+        if flops:
+            costs[scope_of(op.name, depth)]["mflops"] += flops / 1e6
+    return costs
+
+
+def measured_costs(sess, model, images, depth, repeat, costs):
+    run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+    step_stats = None
+    for _ in range(repeat):
+        run_metadata = tf.RunMetadata()
+        sess.run(model.pred, {model.input_data: images}, options=run_options, run_metadata=run_metadata)
+        step_stats = run_metadata.step_stats
+        for dev_stats in step_stats.dev_stats:
+            for node_stats in dev_stats.node_stats:
+                scope = scope_of(node_stats.node_name.split(":")[0], depth)
+                costs[scope]["time_ms"] += node_stats.all_end_rel_micros / 1000.0 / repeat
+                output_bytes = sum(output.tensor_description.allocation_description.requested_bytes
+                                   for output in node_stats.output)
+                costs[scope]["activation_mb"] += output_bytes / 2 ** 20 / repeat
+    return step_stats
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--size', type=str, default='512x512', help='heightxwidth')
+    argparser.add_argument('--batch_size', type=int, default=1)
+    argparser.add_argument('--data_format', type=str, default='NHWC')
+    argparser.add_argument('--efficient', type=str, default=None, help='separable or dilated. None for dense')
+    argparser.add_argument('--depth', type=int, default=2, help='number of scope levels to group by')
+    argparser.add_argument('--sort', type=str, default='time_ms', choices=COLUMNS)
+    argparser.add_argument('--repeat', type=int, default=5)
+    argparser.add_argument('--threads', type=int, default=0, help='intra/inter-op threads. 0 for tensorflow default')
+    argparser.add_argument('--out_dir', type=str, default='./model/profile')
+    args = argparser.parse_args()
+
+    height, width = [int(length) for length in args.size.split("x")]
+    config = bench_config(data_format=args.data_format, efficient=args.efficient or False)
+    graph = tf.Graph()
+    with graph.as_default():
+        model = ForwardOnly(config, [args.batch_size, height, width, 3])
+        init_fn = tf.global_variables_initializer()
+    costs = static_costs(graph, args.depth)
+    images = np.random.randint(0, 256, [args.batch_size, height, width, 3], np.uint8)
+    with tf.Session(graph=graph, config=session_config(args.threads, args.threads)) as sess:
+        sess.run(init_fn)
+        sess.run(model.pred, {model.input_data: images})  # warm up
+        step_stats = measured_costs(sess, model, images, args.depth, args.repeat, costs)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    rows = sorted(([scope] + [costs[scope][column] for column in COLUMNS] for scope in costs),
+                  key=lambda row: row[1 + COLUMNS.index(args.sort)], reverse=True)
+    csv_path = os.path.join(args.out_dir, "profile_%s.csv" % args.size)
+    with open(csv_path, "w") as writer:
+        writer.write("scope, " + ", ".join(COLUMNS) + "\n")
+        for row in rows:
+            writer.write(", ".join(str(value) for value in row) + "\n")
+    trace_path = os.path.join(args.out_dir, "trace_%s.json" % args.size)
+    with open(trace_path, "w") as writer:
+        writer.write(timeline.Timeline(step_stats).generate_chrome_trace_format(show_memory=True))
+
+    total = [sum(row[index] for row in rows) for index in range(1, len(COLUMNS) + 1)]
+    print_table(["scope"] + COLUMNS,
+                [[row[0], int(row[1])] + ["%.2f" % value for value in row[2:]] for row in rows] +
+                [["total", int(total[0])] + ["%.2f" % value for value in total[1:]]])
+    print("profile: %s, trace: %s" % (csv_path, trace_path))
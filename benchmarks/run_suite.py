@@ -0,0 +1,235 @@
+"""
+cpu performance regression suite on synthetic data: tfrecord decode and augmentation, forward latency of architecture_fn,
+a train step of a tiny config, confusion matrix eval throughput and video fps.
+each run is compared with the baseline of this host and exits with 1 if any benchmark regressed beyond the tolerance
+
+usage: python -m benchmarks.run_suite                   # compare with benchmarks/baselines/<hostname>.json
+       python -m benchmarks.run_suite --save_baseline   # store the current results as the baseline
+"""
+from benchmarks.common import ForwardOnly, bench_config, session_config, time_forward, print_table
+from functions.project_fn.autotune import available_cores
+from functions.project_fn.data_pipeline import DataPipeline
+from functions.project_fn.model_handler import ModelHandler
+from functions.project_fn.utils import superimpose
+from bunch import Bunch
+import importlib as imp
+import numpy as np
+import tensorflow as tf
+import cv2 as cv
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def synthetic_image(height, width, seed):
+    # noisy background with a few dark polylines, roughly the statistics of a crack image
+    random_state = np.random.RandomState(seed)
+    image = random_state.randint(90, 170, [height, width, 3]).astype(np.uint8)
+    gt = np.zeros([height, width], np.uint8)
+    for _ in range(3):
+        points = random_state.randint(0, [width, height], [6, 2]).astype(np.int32)
+        cv.polylines(image, [points], False, (40, 40, 40), 3)
+        cv.polylines(gt, [points], False, 1, 3)
+    return image, gt
+
+
+def write_tfrecord(path, num_images, height, width):
+    with tf.io.TFRecordWriter(path) as writer:
+        for index in range(num_images):
+            image, gt = synthetic_image(height, width, index)
+            feature = {"image": cv.imencode(".jpg", image)[1].tobytes(),
+                       "filename": ("synthetic_%d.jpg" % index).encode(),
+                       "segmentation": cv.imencode(".jpg", gt)[1].tobytes()}
+            feature = {key: tf.train.Feature(bytes_list=tf.train.BytesList(value=[value])) for key, value in feature.items()}
+            feature["height"] = tf.train.Feature(int64_list=tf.train.Int64List(value=[height]))
+            feature["width"] = tf.train.Feature(int64_list=tf.train.Int64List(value=[width]))
+            writer.write(tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString())
+
+
+def bench_pipeline(work_dir, threads, num_steps=20):
+    # augmentations of the train config except those reading external files
+    config = dict(imp.import_module("configs.config_train").config)
+    config.update({"phase": "train", "is_train": True, "main_data_dir": work_dir, "second_data_dir": None, "third_data_dir": None,
+                   "batch_size": 8, "crop_size": [256, 256], "shade_prob": 0.0, "num_parallel_calls": 4, "prefetch_size": 4})
+    write_tfrecord(os.path.join(work_dir, "synthetic.tfrecord"), 32, 384, 384)
+    graph = tf.Graph()
+    with graph.as_default():
+        data = DataPipeline(Bunch(config))
+    with tf.Session(graph=graph, config=session_config(threads, threads)) as sess:
+        sess.run(data.input_data)  # warm up
+        start_time = time.time()
+        for _ in range(num_steps):
+            sess.run([data.input_data, data.gt])
+        elapsed = time.time() - start_time
+    return [("pipeline/decode_augment", num_steps * config["batch_size"] / elapsed, "images/sec", True)]
+
+
+def bench_forward(sizes, batch_sizes, threads):
+    results = []
+    graph = tf.Graph()
+    with graph.as_default():
+        model = ForwardOnly(bench_config())
+        init_fn = tf.global_variables_initializer()
+    with tf.Session(graph=graph, config=session_config(threads, threads)) as sess:
+        sess.run(init_fn)
+        for size in sizes:
+            height, width = [int(length) for length in size.split("x")]
+            for batch_size in batch_sizes:
+                latency = time_forward(sess, model, batch_size, height, width, repeat=5)
+                results.append(("forward/%s_batch%d" % (size, batch_size), latency, "sec/batch", False))
+    return results
+
+
+def bench_train_step(threads, batch_size=2, size=128, num_steps=10):
+    graph = tf.Graph()
+    with graph.as_default():
+        model = ForwardOnly(bench_config(is_train=True, weight_decay=0.00001), [batch_size, size, size, 3])
+        model.gt = tf.placeholder(tf.uint8, [batch_size, size, size, 1])
+        model._miou_loss()
+        with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
+            train_op = tf.train.MomentumOptimizer(0.001, 0.9).minimize(model.loss)
+        init_fn = tf.global_variables_initializer()
+    image, gt = synthetic_image(size, size, 0)
+    feed_dict = {model.input_data: np.stack([image] * batch_size), model.gt: np.stack([gt[:, :, None]] * batch_size)}
+    with tf.Session(graph=graph, config=session_config(threads, threads)) as sess:
+        sess.run(init_fn)
+        sess.run(train_op, feed_dict)  # warm up
+        start_time = time.time()
+        for _ in range(num_steps):
+            sess.run(train_op, feed_dict)
+        elapsed = time.time() - start_time
+    return [("train_step/%dx%d_batch%d" % (size, size, batch_size), elapsed / num_steps, "sec/step", False)]
+
+
+class MetricOnly(ModelHandler):
+    """
+    streaming metric of EvalHandler on fed logits, without the network
+    """
+
+    def __init__(self, config, input_shape):
+        self.config = config
+        self.logit = tf.placeholder(tf.float32, input_shape + [config.num_classes])
+        self.gt = tf.placeholder(tf.uint8, input_shape + [1])
+        self.height = None
+        self.width = None
+        self._build_streaming_metric()
+
+
+def bench_eval_metric(threads, batch_size=4, size=1024, num_steps=20):
+    graph = tf.Graph()
+    with graph.as_default():
+        model = MetricOnly(bench_config(num_thresholds=100), [batch_size, size, size])
+        init_fn = tf.local_variables_initializer()
+    random_state = np.random.RandomState(0)
+    feed_dict = {model.logit: random_state.randn(batch_size, size, size, 2).astype(np.float32),
+                 model.gt: random_state.randint(0, 2, [batch_size, size, size, 1]).astype(np.uint8)}
+    with tf.Session(graph=graph, config=session_config(threads, threads)) as sess:
+        sess.run(init_fn)
+        sess.run(model.metric_update_op, feed_dict)  # warm up
+        start_time = time.time()
+        for _ in range(num_steps):
+            sess.run(model.metric_update_op, feed_dict)
+        elapsed = time.time() - start_time
+    return [("eval/confusion_matrix", num_steps * batch_size * size * size / elapsed / 1e6, "Mpixels/sec", True)]
+
+
+def bench_video(work_dir, threads, num_frames=30, height=360, width=640):
+    # decode, forward, superimpose and encode of every frame as phase=vis with data_type=video
+    src_name = os.path.join(work_dir, "synthetic.avi")
+    writer = cv.VideoWriter(src_name, cv.VideoWriter_fourcc(*"MJPG"), 30, (width, height))
+    for index in range(num_frames):
+        writer.write(synthetic_image(height, width, index)[0])
+    writer.release()
+    graph = tf.Graph()
+    with graph.as_default():
+        model = ForwardOnly(bench_config())
+        init_fn = tf.global_variables_initializer()
+    with tf.Session(graph=graph, config=session_config(threads, threads)) as sess:
+        sess.run(init_fn)
+        vid = cv.VideoCapture(src_name)
+        vid_out = cv.VideoWriter(os.path.join(work_dir, "result.avi"), cv.VideoWriter_fourcc(*"MJPG"), 30, (width, height))
+        num_read = 0
+        start_time = time.time()
+        should_continue, frame = vid.read()
+        while should_continue:
+            pred = sess.run(model.pred, {model.input_data: np.expand_dims(frame, 0)})[0]
+            vid_out.write(superimpose(frame, pred))
+            num_read += 1
+            should_continue, frame = vid.read()
+        elapsed = time.time() - start_time
+        vid_out.release()
+    if not num_read:
+        raise ValueError("The synthetic clip could not be decoded. opencv may be built without video support")
+    return [("video/%dx%d" % (width, height), num_read / elapsed, "fps", True)]
+
+
+def compare(results, baseline, tolerance):
+    rows = []
+    regressions = []
+    for name, value, unit, higher_is_better in results:
+        if name not in baseline["results"]:
+            rows.append([name, unit, "n/a", "%.4f" % value, "n/a", "new"])
+            continue
+        baseline_value = baseline["results"][name]["value"]
+        change = (value - baseline_value) / baseline_value
+        worse = -change if higher_is_better else change
+        if worse > tolerance:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif worse < -tolerance:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append([name, unit, "%.4f" % baseline_value, "%.4f" % value, "%+.1f%%" % (change * 100), status])
+    print_table(["benchmark", "unit", "baseline", "current", "change", "status"], rows)
+    return regressions
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--sizes', type=str, nargs='+', default=['256x256', '512x512', '1024x1024'], help='heightxwidth')
+    argparser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4])
+    argparser.add_argument('--threads', type=int, default=0, help='intra/inter-op threads. 0 for tensorflow default')
+    argparser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown reported as a regression')
+    argparser.add_argument('--only', type=str, nargs='*', default=None, help='pipeline, forward, train_step, eval, video')
+    argparser.add_argument('--save_baseline', action='store_true')
+    args = argparser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    suite = {"pipeline": lambda: bench_pipeline(work_dir, args.threads),
+             "forward": lambda: bench_forward(args.sizes, args.batch_sizes, args.threads),
+             "train_step": lambda: bench_train_step(args.threads),
+             "eval": lambda: bench_eval_metric(args.threads),
+             "video": lambda: bench_video(work_dir, args.threads)}
+    results = []
+    for name in args.only or suite.keys():
+        print("Running %s..." % name)
+        results.extend(suite[name]())
+
+    baseline_path = os.path.join(BASELINE_DIR, "%s.json" % socket.gethostname())
+    # timings depend on the host, so a baseline is only comparable on the host and thread setting it was taken with
+    environment = {"host": socket.gethostname(), "cores": available_cores(), "threads": args.threads, "tensorflow": tf.__version__}
+    baseline = {"environment": environment, "results": dict()}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as reader:
+            baseline = json.load(reader)
+        if baseline["environment"] != environment:
+            print("Baseline was taken with %s, current run is %s" % (baseline["environment"], environment))
+    regressions = compare(results, baseline, args.tolerance)
+    if args.save_baseline:
+        baseline["environment"] = environment
+        baseline["results"].update({name: {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+                                    for name, value, unit, higher_is_better in results})
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, "w") as writer:
+            json.dump(baseline, writer, indent=2, sort_keys=True)
+        print("Baseline is saved: %s" % baseline_path)
+    elif regressions:
+        print("Regressions beyond %.0f%%: %s" % (args.tolerance * 100, ", ".join(regressions)))
+        sys.exit(1)
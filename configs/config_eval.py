@@ -1,13 +1,31 @@
 # evaluation Config
 config = {
     "physical_gpu_id": 0,
+    "device": "/GPU:0",  # device of the network. /CPU:0 for cpu-only hosts
+    "data_format": "NHWC",  # option: NHWC or NCHW. NCHW is faster on GPUs and MKL-enabled CPU builds
     "dtype": "fp32",
     "num_classes": 2,
+    "efficient": False,  # option: False (dense), separable or dilated. must match the trained model
+    "efficient_min_kernel": 7,  # kernels of this size or larger are replaced in the efficient variant
+    "pruned_arch": None,  # architecture json written by phase=prune. checkpoints are read from ./model/pruned_checkpoints
+    "tta": None,  # list of test-time augmentations: flip_lr, flip_ud, rot90, rot180, rot270, transpose. None for skipping
     "ckpt_start": 400000,
     "ckpt_end": 400000,
     "ckpt_step": 1,
     "img_step": 1,
+    "batch_size": 1,  # more than 1 groups images by size and pads them to a multiple of 16
     "img_dir": None,  # folder path of jpg images
     "seg_dir": None,  # folder path of ground truth
     "eval_log_dir": "evaluation",
+    "per_image_metric": False,  # True to write metrics of every image to metric_per_image_<ckpt>.csv
+    "num_thresholds": 100,  # number of crack probability thresholds for the precision-recall curve. None for skipping
+
+    # coarse-to-fine inference
+    "roi_inference": False,  # True to run full resolution only on tiles around candidates of a downscaled pass
+    "roi_scale": 0.25,  # scale of the coarse pass
+    "roi_threshold": 0.2,  # crack probability of the coarse pass marking candidates. lower for higher recall
+    "roi_margin": 1,  # number of neighbouring tiles added around candidate tiles
+    "roi_tile_size": 256,  # multiple of 16
+    "roi_context": 32,  # border of context pixels around each tile, multiple of 8
+    "roi_batch_size": 8,  # tiles per forward pass
 }
@@ -0,0 +1,18 @@
+# export Config
+config = {
+    "physical_gpu_id": 0,
+    "device": "/GPU:0",  # device of the network. /CPU:0 for cpu-only hosts
+    "data_format": "NHWC",  # option: NHWC or NCHW. NCHW is faster on GPUs and MKL-enabled CPU builds
+    "dtype": "fp32",
+    "num_classes": 2,
+    "efficient": False,  # option: False (dense), separable or dilated. must match the trained model
+    "efficient_min_kernel": 7,  # kernels of this size or larger are replaced in the efficient variant
+    "pruned_arch": None,  # architecture json written by phase=prune. checkpoints are read from ./model/pruned_checkpoints
+    "ckpt_id": 400000,
+    "input_size": None,  # [height, width] for a fixed input size. None for dynamic batch and input size
+    "export_format": "frozen_graph",  # option: frozen_graph or saved_model
+    "export_dir": "export",
+    "check_dir": None,  # folder path of jpg images to compare exported masks with the checkpoint. None for skipping
+    "check_num": 16,  # max number of images used in the check
+    "check_min_agreement": 0.999,  # min ratio of pixels whose exported mask matches the checkpoint mask
+}
@@ -0,0 +1,19 @@
+# pruning Config
+config = {
+    "physical_gpu_id": 0,
+    "device": "/GPU:0",  # device of the network. /CPU:0 for cpu-only hosts
+    "data_format": "NHWC",  # option: NHWC or NCHW. NCHW is faster on GPUs and MKL-enabled CPU builds
+    "dtype": "fp32",
+    "num_classes": 2,
+    "efficient": False,  # option: False (dense), separable or dilated. must match the trained model
+    "efficient_min_kernel": 7,  # kernels of this size or larger are replaced in the efficient variant
+    "ckpt_id": 400000,
+    "prune_ratio": 0.3,  # ratio of the channels of prunable conv_blocks removed, ranked by |batch norm gamma| over all layers
+    "min_keep_ratio": 0.25,  # min ratio of the channels kept in each conv_block
+    "finetuned_ckpt_id": None,  # step of a fine-tuned checkpoint in ./model/pruned_checkpoints to add to the report. None for skipping
+    "latency_size": [512, 512],  # [height, width] of random inputs to measure latency
+    "latency_repeat": 20,
+    "img_step": 1,
+    "img_dir": None,  # folder path of jpg images. None for skipping mIoU
+    "seg_dir": None,  # folder path of ground truth
+}
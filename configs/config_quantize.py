@@ -0,0 +1,11 @@
+# quantization Config
+config = {
+    "physical_gpu_id": 0,
+    "num_classes": 2,
+    "ckpt_id": 400000,  # frozen graph exported with a fixed input_size by phase=export
+    "int8_only": False,  # True to fail on ops without int8 kernels instead of running them in fp32
+    "calibration_num": 100,  # number of eval images used to calibrate activation ranges
+    "img_step": 1,
+    "img_dir": None,  # folder path of jpg images
+    "seg_dir": None,  # folder path of ground truth
+}
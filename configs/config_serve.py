@@ -0,0 +1,10 @@
+# serving Config
+config = {
+    "physical_gpu_id": 0,
+    "num_classes": 2,
+    "ckpt_id": 400000,  # frozen graph exported with input_size=None by phase=export
+    "host": "127.0.0.1",
+    "port": 8500,
+    "max_batch_size": 8,
+    "max_latency_ms": 10,  # max time the first request of a batch waits for more requests
+}
@@ -3,7 +3,12 @@ config = {
     # GPU
     "dtype": "fp16",
     "physical_gpu_id": 0,
-    "efficient": True,
+    "device": "/GPU:0",  # device of the network. /CPU:0 for cpu-only hosts
+    "data_format": "NHWC",  # option: NHWC or NCHW. NCHW is faster on GPUs and MKL-enabled CPU builds
+    "efficient": False,  # option: False (dense), separable or dilated. must match in eval, vis and export
+    "efficient_min_kernel": 7,  # kernels of this size or larger are replaced in the efficient variant
+    "pruned_arch": None,  # architecture json written by phase=prune. checkpoints are saved in ./model/pruned_checkpoints
+    "init_ckpt": None,  # checkpoint to start from if ckpt_dir is empty, e.g. ./model/pruned/model_step-400000 for fine-tuning
 
     # optimization
     "num_classes": 2,
@@ -22,6 +27,11 @@ config = {
     "ckpt_save_interval": 256,
     "summary_save_interval": 512,
 
+    # periodic validation on rank 0 without reloading checkpoints. logged to tensorboard and ckpt_dir/validation.csv
+    "val_interval": None,  # steps between validations. None for skipping
+    "val_img_dir": None,  # folder path of jpg images of a small validation set. decoded once and kept in memory
+    "val_seg_dir": None,  # folder path of ground truth
+
     # input
     "main_data_dir": None,  # tfrecord_folder
     "second_data_dir": None,  # tfrecord_folder
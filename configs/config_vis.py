@@ -1,11 +1,48 @@
 # visualization Config
 config = {
     "physical_gpu_id": 0,
+    "device": "/GPU:0",  # device of the network. /CPU:0 for cpu-only hosts
+    "data_format": "NHWC",  # option: NHWC or NCHW. NCHW is faster on GPUs and MKL-enabled CPU builds
     "dtype": "fp32",
     "num_classes": 2,
+    "efficient": False,  # option: False (dense), separable or dilated. must match the trained model
+    "efficient_min_kernel": 7,  # kernels of this size or larger are replaced in the efficient variant
+    "pruned_arch": None,  # architecture json written by phase=prune. checkpoints are read from ./model/pruned_checkpoints
+    "tta": None,  # list of test-time augmentations: flip_lr, flip_ud, rot90, rot180, rot270, transpose. None for skipping
     "data_type": "image",  # option: image or video
     "data_dir": "",  # folder path where jpg/png/avi/mp4 is
     "img_step": 1,
+    "batch_size": 1,  # more than 1 groups images by size and pads them to a multiple of 16 (image only)
     "ckpt_id": 400000,
     "vis_result_dir": "vis",
+    "vis_output": "overlay",  # option: overlay, rle or bitpack. rle and bitpack write compact .npz masks (image only)
+    "crack_geometry": False,  # True to write crack polylines with length and width to crack_geometry.jsonl (image only)
+    "crack_min_length": 10.0,  # cracks shorter than this in pixels are not recorded
+    "polyline_epsilon": 2.0,  # max distance in pixels between a polyline and the crack skeleton
+    "vis_writer_threads": 4,  # threads superimposing and writing results while the next image is processed
+    "vis_max_pending": 16,  # max number of results waiting to be written
+
+    # coarse-to-fine inference (image only)
+    "roi_inference": False,  # True to run full resolution only on tiles around candidates of a downscaled pass
+    "roi_scale": 0.25,  # scale of the coarse pass
+    "roi_threshold": 0.2,  # crack probability of the coarse pass marking candidates. lower for higher recall
+    "roi_margin": 1,  # number of neighbouring tiles added around candidate tiles
+    "roi_tile_size": 256,  # multiple of 16
+    "roi_context": 32,  # border of context pixels around each tile, multiple of 8
+    "roi_batch_size": 8,  # tiles per forward pass
+
+    # adaptive keyframe inference (video only)
+    "video_keyframe": False,  # True to run the network only on keyframes and warp their masks to the other frames
+    "keyframe_max_gap": 10,  # max number of frames between keyframes
+    "keyframe_diff_threshold": 0.05,  # mean absolute frame difference [0, 1] that forces a keyframe
+    "keyframe_max_warp_error": 0.02,  # mean absolute error [0, 1] of the warped keyframe that forces a keyframe
+    "keyframe_motion_scale": 0.25,  # scale of the frames used to estimate motion
+    "keyframe_validate_interval": 0,  # run the network on every n-th propagated frame to measure mask iou. 0 for skipping
+    "keyframe_min_iou": 0.8,  # validation frames whose propagated mask iou is lower are counted in the report
+
+    # multi-process image visualization
+    "num_workers": 1,  # number of worker processes, each pinned to a slice of the cpu cores. 1 for in-process, which
+                      # crack_geometry and roi_inference need
+    "worker_intra_op_threads": None,  # intra-op threads of each worker. None for the number of its cores
+    "worker_weights_dir": "/dev/shm",  # folder of the temporary frozen graph loaded by the workers. /dev/shm avoids a disk write
 }
@@ -0,0 +1,176 @@
+"""
+host-aware parallelism of the data pipeline and the session.
+--autotune benchmarks a few settings on the current config and saves the best ones to a profile of the host.
+deploy() reads the profile, so later runs on the same host use the tuned settings
+"""
+from bunch import Bunch
+import json
+import math
+import os
+import socket
+import time
+
+PROFILE_DIR = "./model/autotune"
+DEFAULT_SETTINGS = {"num_parallel_calls": 4,  # parallel calls of the parsers of the data pipeline
+                    "prefetch_size": 4,  # batches prepared ahead of the model
+                    "intra_op_threads": 0,  # threads of each op. 0 lets tensorflow decide
+                    "inter_op_threads": 0}  # ops run at the same time. 0 lets tensorflow decide
+TOLERANCE = 0.05  # the cheapest setting within this ratio of the best throughput is chosen to leave cores for other work
+
+
+def available_cores():
+    """
+    cores this process may use: the cpu affinity limited by the cgroup cpu quota of containers
+    """
+    cores = len(os.sched_getaffinity(0))
+    quota = None
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as reader:
+            max_quota, period = reader.read().split()
+        if max_quota != "max":
+            quota = int(max_quota) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: quota of -1 is unlimited
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as reader:
+                max_quota = int(reader.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as reader:
+                period = int(reader.read())
+            if max_quota > 0:
+                quota = max_quota / period
+        except (OSError, ValueError):
+            pass
+    if quota:
+        cores = min(cores, max(int(math.ceil(quota)), 1))
+    return cores
+
+
+def _profile_path():
+    return os.path.join(PROFILE_DIR, "%s.json" % socket.gethostname())
+
+
+def load_profile(phase):
+    """
+    returns the tuned settings of the phase on this host, or DEFAULT_SETTINGS if it was not tuned
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    if not os.path.exists(_profile_path()):
+        return settings
+    with open(_profile_path()) as reader:
+        profile = json.load(reader)
+    if profile["cores"] != available_cores():
+        print("Autotune profile is ignored: tuned for %d cores, %d are available" % (profile["cores"], available_cores()))
+    elif phase in profile["phases"]:
+        settings.update(profile["phases"][phase])
+    return settings
+
+
+def _save_profile(phase, settings):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile = {"cores": available_cores(), "phases": dict()}
+    if os.path.exists(_profile_path()):
+        with open(_profile_path()) as reader:
+            profile = json.load(reader)
+        if profile["cores"] != available_cores():
+            profile = {"cores": available_cores(), "phases": dict()}  # settings of other phases are stale
+    profile["phases"][phase] = settings
+    with open(_profile_path(), "w") as writer:
+        json.dump(profile, writer, indent=2, sort_keys=True)
+
+
+def _candidates(cores):
+    return sorted(set([1, max(cores // 4, 1), max(cores // 2, 1), cores]))
+
+
+def _pick(results):
+    # results: [(setting, images/sec)] in order of preference, e.g. from the cheapest setting
+    best = max(throughput for _, throughput in results)
+    for setting, throughput in results:
+        if throughput >= best * (1 - TOLERANCE):
+            return setting
+
+
+def autotune(config, num_steps=20):
+    """
+    benchmarks the data pipeline and the forward pass of the current config and saves the best settings
+    """
+    from functions.project_fn.data_pipeline import DataPipeline
+    from functions.project_fn.model_handler import ModelHandler
+    import tensorflow as tf
+
+    if config.phase not in ["train", "eval", "vis"] or (config.phase == "vis" and (config.data_type != "image" or config.num_workers > 1)):
+        raise ValueError("autotune supports phase=train, eval and vis of images with num_workers=1")
+
+    class ForwardModel(ModelHandler):
+        def _build_model(self):
+            self.architecture_fn()
+
+    def run_steps(sess, fetch, data_init, feed_dict=None):
+        # images/sec over num_steps batches after a warm-up
+        if data_init is not None:
+            sess.run(data_init)
+        num_images = 0
+        start_time = None
+        for step in range(num_steps + 2):
+            if step == 2:
+                start_time = time.time()
+                num_images = 0
+            try:
+                num_images += len(sess.run(fetch, feed_dict))
+            except tf.errors.OutOfRangeError:
+                sess.run(data_init)
+        return num_images / (time.time() - start_time)
+
+    def pipeline_throughput(settings):
+        graph = tf.Graph()
+        with graph.as_default():
+            data = DataPipeline(Bunch(dict(config, **settings)))
+        with tf.Session(graph=graph) as sess:
+            return run_steps(sess, data.input_data, data.data_init)
+
+    cores = available_cores()
+    print("Autotuning on %s with %d cores..." % (socket.gethostname(), cores))
+    settings = dict(DEFAULT_SETTINGS)
+    results = []
+    for num_parallel_calls in _candidates(cores):
+        throughput = pipeline_throughput(dict(settings, num_parallel_calls=num_parallel_calls))
+        print("num_parallel_calls=%d: %.1f images/sec" % (num_parallel_calls, throughput))
+        results.append((num_parallel_calls, throughput))
+    settings["num_parallel_calls"] = _pick(results)
+    results = []
+    for prefetch_size in [1, 2, 4, 8]:
+        throughput = pipeline_throughput(dict(settings, prefetch_size=prefetch_size))
+        print("prefetch_size=%d: %.1f images/sec" % (prefetch_size, throughput))
+        results.append((prefetch_size, throughput))
+    settings["prefetch_size"] = _pick(results)
+
+    # the forward pass is timed on one fixed batch so that only the session thread pools change
+    graph = tf.Graph()
+    with graph.as_default():
+        tuned_config = Bunch(dict(config, **settings))
+        model = ForwardModel(DataPipeline(tuned_config), tuned_config)
+        init_fn = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
+    with tf.Session(graph=graph) as sess:
+        if model.data_init is not None:
+            sess.run(model.data_init)
+        batch = sess.run(model.input_data)
+    results = []
+    # from the fewest threads. 0 (tensorflow default) is tried last so that explicit settings win ties
+    thread_candidates = [(max(cores // 2, 1), 1), (cores, 1), (cores, 2), (0, 0)]
+    for intra_op_threads, inter_op_threads in sorted(set(thread_candidates), key=thread_candidates.index):
+        # per-session thread pools. otherwise every session shares the inter-op pool of the first one
+        session_config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                                        inter_op_parallelism_threads=inter_op_threads,
+                                        use_per_session_threads=True,
+                                        allow_soft_placement=True)
+        with tf.Session(graph=graph, config=session_config) as sess:
+            sess.run(init_fn)
+            throughput = run_steps(sess, model.logit, None, {model.input_data: batch})
+        print("intra_op_threads=%d, inter_op_threads=%d: %.1f images/sec" % (intra_op_threads, inter_op_threads, throughput))
+        results.append(((intra_op_threads, inter_op_threads), throughput))
+    settings["intra_op_threads"], settings["inter_op_threads"] = _pick(results)
+
+    _save_profile(config.phase, settings)
+    print("Autotuned settings of %s are saved: %s" % (config.phase, json.dumps(settings, sort_keys=True)))
+    return settings
@@ -0,0 +1,130 @@
+import cv2 as cv
+import numpy as np
+
+# neighbours P2, P3, ..., P9 of Zhang-Suen thinning in clockwise order from the top
+_NEIGHBOR_OFFSETS = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+
+
+def _neighbors(image):
+    padded = np.pad(image, 1)
+    h, w = image.shape
+    return [padded[1 + dy:1 + dy + h, 1 + dx:1 + dx + w] for dy, dx in _NEIGHBOR_OFFSETS]
+
+
+def skeletonize(mask):
+    """
+    Zhang-Suen thinning of a binary mask. every sub-iteration is evaluated on the whole image at once
+
+    mask: array of [height, width]. nonzero pixels are regarded as crack
+    returns: uint8 skeleton of [height, width]
+    """
+    if hasattr(cv, "ximgproc"):
+        return (cv.ximgproc.thinning((mask != 0).astype(np.uint8) * 255) > 0).astype(np.uint8)
+    skeleton = (mask != 0).astype(np.uint8)
+    while True:
+        changed = False
+        for step in range(2):
+            p2, p3, p4, p5, p6, p7, p8, p9 = _neighbors(skeleton)
+            sequence = [p2, p3, p4, p5, p6, p7, p8, p9, p2]
+            num_neighbors = p2 + p3 + p4 + p5 + p6 + p7 + p8 + p9
+            num_transitions = sum((sequence[i] == 0) & (sequence[i + 1] == 1) for i in range(8))
+            if step == 0:
+                exclusion = (p2 * p4 * p6 == 0) & (p4 * p6 * p8 == 0)
+            else:
+                exclusion = (p2 * p4 * p8 == 0) & (p2 * p6 * p8 == 0)
+            removal = (skeleton == 1) & (num_neighbors >= 2) & (num_neighbors <= 6) & (num_transitions == 1) & exclusion
+            if removal.any():
+                skeleton[removal] = 0
+                changed = True
+        if not changed:
+            return skeleton
+
+
+def _is_redundant(window):
+    """
+    whether the centre of a 3x3 window of a skeleton is a staircase corner that can be removed.
+    it has a vertical and a horizontal neighbour, is not an endpoint, and its neighbours stay 8-connected without it
+    """
+    sequence = [window[1 + dy, 1 + dx] for dy, dx in _NEIGHBOR_OFFSETS]
+    if sum(sequence) < 2 or not ((sequence[0] or sequence[4]) and (sequence[2] or sequence[6])):
+        return False
+    # a diagonal position between two orthogonal neighbours links them even if it is empty
+    for index in range(1, 8, 2):
+        sequence[index] = sequence[index] or (sequence[index - 1] and sequence[(index + 1) % 8])
+    return sum(not sequence[i] and sequence[(i + 1) % 8] for i in range(8)) == 1
+
+
+def minimal_skeleton(skeleton):
+    """
+    removes the corners of 4-connected staircases, which thinning leaves on inclined lines, so that every step is one
+    diagonal link. corners are removed one by one because removing two neighbouring corners at once can split a curve
+
+    skeleton: uint8 skeleton of [height, width]
+    returns: uint8 skeleton of [height, width]
+    """
+    p2, p3, p4, p5, p6, p7, p8, p9 = _neighbors(skeleton)
+    candidates = (skeleton != 0) & ((p2 | p6) != 0) & ((p4 | p8) != 0)
+    padded = np.pad(skeleton, 1)
+    for y, x in zip(*np.nonzero(candidates)):
+        if _is_redundant(padded[y:y + 3, x:x + 3]):
+            padded[y + 1, x + 1] = 0
+    return padded[1:-1, 1:-1]
+
+
+def _segment_lengths(skeleton, labels, num_labels):
+    # orthogonal links count 1 and diagonal links count sqrt(2).
+    # on a minimal skeleton no diagonal link has a corner pixel, so no step is counted twice
+    h, w = skeleton.shape
+    lengths = np.zeros(num_labels)
+    for (dy, dx), weight in [((0, 1), 1.0), ((1, 0), 1.0), ((1, 1), 2 ** 0.5), ((1, -1), 2 ** 0.5)]:
+        x0, x1 = max(-dx, 0), w - max(dx, 0)
+        linked = (skeleton[:h - dy, x0:x1] & skeleton[dy:, x0 + dx:x1 + dx]).astype(bool)
+        lengths += np.bincount(labels[:h - dy, x0:x1][linked], minlength=num_labels) * weight
+    return lengths
+
+
+def _polyline(labels, label, bbox, endpoints, epsilon):
+    x, y, w, h = bbox
+    component = (labels[y:y + h, x:x + w] == label).astype(np.uint8)
+    contours, _ = cv.findContours(component, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_NONE)
+    contour = max(contours, key=len)[:, 0, :] + [x, y]  # [num_points, (x, y)]
+    end_index = np.flatnonzero(endpoints[contour[:, 1], contour[:, 0]])
+    if len(end_index) >= 2:
+        # the contour of a one pixel wide curve runs from one end to the other and back
+        contour = contour[end_index[0]:end_index[1] + 1]
+    return cv.approxPolyDP(contour.reshape(-1, 1, 2).astype(np.int32), epsilon, False)[:, 0, :]
+
+
+def extract_crack_geometry(pred, min_length=10.0, epsilon=2.0):
+    """
+    crack polylines with length and width estimates in pixels
+
+    pred: prediction of [height, width]. nonzero pixels are regarded as crack
+    min_length: cracks shorter than min_length are dropped
+    epsilon: max distance between a polyline and the skeleton it simplifies
+    """
+    mask = (pred != 0).astype(np.uint8)
+    skeleton = minimal_skeleton(skeletonize(mask))
+    num_labels, labels, stats, _ = cv.connectedComponentsWithStats(skeleton, connectivity=8)
+    if num_labels <= 1:
+        return []
+    # a skeleton pixel is at the centre of the crack, so the local width is about twice the distance to the background
+    width = np.maximum(cv.distanceTransform(mask, cv.DIST_L2, 3) * 2.0 - 1.0, 1.0)
+    on_skeleton = skeleton.astype(bool)
+    skeleton_labels = labels[on_skeleton]
+    num_pixels = np.bincount(skeleton_labels, minlength=num_labels)
+    width_sum = np.bincount(skeleton_labels, width[on_skeleton], minlength=num_labels)
+    width_max = np.zeros(num_labels)
+    np.maximum.at(width_max, skeleton_labels, width[on_skeleton])
+    lengths = _segment_lengths(skeleton, labels, num_labels)
+    endpoints = on_skeleton & (sum(_neighbors(skeleton)) == 1)
+
+    cracks = []
+    for label in range(1, num_labels):
+        if lengths[label] < min_length:
+            continue
+        cracks.append({"polyline": _polyline(labels, label, stats[label, :4], endpoints, epsilon).tolist(),
+                       "length_px": round(float(lengths[label]), 2),
+                       "mean_width_px": round(float(width_sum[label] / num_pixels[label]), 2),
+                       "max_width_px": round(float(width_max[label]), 2)})
+    return cracks
@@ -1,10 +1,13 @@
 from functions.project_fn.preprocess import Preprocessing
+from functions.project_fn.frozen_model import INPUT_NODE
 from functions.project_fn.utils import list_getter
 import tensorflow as tf
 import os
 
 
 class DataPipeline(Preprocessing):
+    total_stride = 16  # input size divisor of the network
+
     def __init__(self, config):
         self.tfrecord_feature = {"image": tf.FixedLenFeature((), tf.string, default_value=""),
                                  "filename": tf.FixedLenFeature((), tf.string, default_value=""),
@@ -12,6 +15,8 @@ class DataPipeline(Preprocessing):
                                  "width": tf.FixedLenFeature((), tf.int64, default_value=0),
                                  "segmentation": tf.FixedLenFeature((), tf.string, default_value="")}
         self.config = config
+        self.height = None  # original image sizes of the batch. None if inputs are not padded
+        self.width = None
         self._drop_remainder = True if self.config.phase == "Train" else False
         self._build_input_pipeline()
 
@@ -27,11 +32,32 @@ class DataPipeline(Preprocessing):
     def _image_gt_parser(image_name, gt_name):
         image = tf.image.decode_png(tf.read_file(image_name), 3)
         gt = tf.image.decode_png(tf.read_file(gt_name), 1)
-        return {"input_data": image, "gt": gt, "filename": image_name}
+        return {"input_data": image, "gt": gt, "filename": image_name, "height": tf.shape(image)[0], "width": tf.shape(image)[1]}
 
     @staticmethod
     def _image_parser(image_name):
-        return {"input_data": tf.image.decode_png(tf.read_file(image_name), 3), "filename": image_name}
+        image = tf.image.decode_png(tf.read_file(image_name), 3)
+        return {"input_data": image, "filename": image_name, "height": tf.shape(image)[0], "width": tf.shape(image)[1]}
+
+    def _pad_to_stride(self, data):
+        # images are zero-padded at the bottom and right to a multiple of the network stride.
+        # height and width keep the original size so that the padding can be cropped off after the forward pass
+        pad_h = -data["height"] % self.total_stride
+        pad_w = -data["width"] % self.total_stride
+        data["input_data"] = tf.pad(data["input_data"], [[0, pad_h], [0, pad_w], [0, 0]])
+        if "gt" in data:
+            data["gt"] = tf.pad(data["gt"], [[0, pad_h], [0, pad_w], [0, 0]])
+        return data
+
+    def _size_bucketed_batch(self, data):
+        def key_fn(data):
+            padded_shape = tf.cast(tf.shape(data["input_data"]), tf.int64)
+            return padded_shape[0] * 100000 + padded_shape[1]
+
+        data = data.map(self._pad_to_stride, self.config.num_parallel_calls)
+        return data.apply(tf.data.experimental.group_by_window(key_fn,
+                                                               lambda key, window: window.batch(self.config.batch_size),
+                                                               self.config.batch_size))
 
     def _get_batch_and_init(self, tfrecord_dir, batch_size):
         tfrecord_list = list_getter(tfrecord_dir, extension="tfrecord")
@@ -40,8 +66,8 @@ class DataPipeline(Preprocessing):
         data = tf.data.TFRecordDataset(tfrecord_list)
         data = data.repeat()
         data = data.shuffle(batch_size * 10)
-        data = data.map(self._tfrecord_parser, 4).batch(batch_size, self._drop_remainder)
-        data = data.prefetch(4)  # tf.data_pipeline.experimental.AUTOTUNE
+        data = data.map(self._tfrecord_parser, self.config.num_parallel_calls).batch(batch_size, self._drop_remainder)
+        data = data.prefetch(self.config.prefetch_size)  # tuned per host by --autotune
         iterator = data.make_one_shot_iterator()
         return iterator.get_next()
 
@@ -120,22 +146,29 @@ class DataPipeline(Preprocessing):
         img_list_tensor = tf.convert_to_tensor(img_list, dtype=tf.string)
         img_data = tf.data.Dataset.from_tensor_slices(img_list_tensor)
         if self.config.phase == "eval":
-            gt_list = list_getter(self.seg_dir, "png")
+            gt_list = list_getter(self.config.seg_dir, "png")
             inspect_pairness(gt_list, img_list)
             inspect_file_extension(gt_list)
             inspect_file_extension(img_list)
             gt_list_tensor = tf.convert_to_tensor(gt_list, dtype=tf.string)
             gt_data = tf.data.Dataset.from_tensor_slices(gt_list_tensor)
             data = tf.data.Dataset.zip((img_data, gt_data))
-            data = data.map(self._image_gt_parser, 4).batch(self.config.batch_size, False)
+            data = data.map(self._image_gt_parser, self.config.num_parallel_calls)
         else:
-            data = img_data.map(self._image_parser, 4).batch(self.config.batch_size, False)
-        data = data.prefetch(4)  # tf.data_pipeline.experimental.AUTOTUNE
+            data = img_data.map(self._image_parser, self.config.num_parallel_calls)
+        if self.config.batch_size > 1:
+            # images of different sizes are grouped by their padded size so that several go through each forward pass
+            data = self._size_bucketed_batch(data)
+        else:
+            data = data.batch(self.config.batch_size, False)
+        data = data.prefetch(self.config.prefetch_size)  # tuned per host by --autotune
         iterator = data.make_initializable_iterator()
         dataset = iterator.get_next()
         self.input_data = dataset["input_data"]
         self.gt = dataset["gt"] if self.config.phase == "eval" else None
         self.filename = dataset["filename"]
+        self.height = dataset["height"]
+        self.width = dataset["width"]
         self.data_init = iterator.initializer
 
     def _build_input_pipeline(self):
@@ -144,7 +177,13 @@ class DataPipeline(Preprocessing):
         elif self.config.phase == "eval":
             self._input_from_image()
         elif self.config.phase == "vis":
-            if self.config.data_type == "image":
+            if self.config.data_type == "image" and self.config.num_workers > 1:
+                # images are read by the workers. the graph only needs an entry point to be frozen
+                self.input_data = tf.placeholder(tf.uint8, [None, None, None, 3], name=INPUT_NODE)
+                self.gt = None
+                self.filename = None
+                self.data_init = None
+            elif self.config.data_type == "image":
                 self._input_from_image()
             elif self.config.data_type == "video":
                 # input_data and gt will be handled by ModelHandler
@@ -152,3 +191,13 @@ class DataPipeline(Preprocessing):
                 self.gt = None
                 self.filename = None
                 self.data_init = None
+        elif self.config.phase in ["export", "prune"]:
+            # a single named entry point of the exported graph
+            if self.config.input_size:
+                input_shape = [1, self.config.input_size[0], self.config.input_size[1], 3]
+            else:
+                input_shape = [None, None, None, 3]
+            self.input_data = tf.placeholder(tf.uint8, input_shape, name=INPUT_NODE)
+            self.gt = None
+            self.filename = None
+            self.data_init = None
@@ -1,4 +1,5 @@
 import importlib as imp
+from functions.project_fn.autotune import load_profile
 from bunch import Bunch
 import os
 
@@ -8,6 +9,9 @@ def deploy(args):
     config_path = ".".join(["configs", "config_%s" % phase])
     config = imp.import_module(config_path).config
     config["ckpt_dir"] = "/".join(["./model", "checkpoints"])
+    if config.get("pruned_arch"):
+        # checkpoints of a pruned model are kept apart from those of the original
+        config["ckpt_dir"] = "/".join(["./model", "pruned_checkpoints"])
     config['phase'] = phase
     if phase == "train":
         config["is_train"] = True
@@ -17,7 +21,8 @@ def deploy(args):
         config["third_data_dir"] = None
         config["second_data_dir"] = None
         config["eval_log_dir"] = "/".join(["./model", "eval_metric"])
-        config["batch_size"] = 1
+        # images of different sizes are batched by size buckets. videos are processed frame by frame
+        config["batch_size"] = config.get("batch_size", 1)
         if phase == "eval":
             config["eval_log_dir"] = "/".join(["./model", "eval_metric"])
             os.makedirs(config["eval_log_dir"], exist_ok=True)
@@ -27,9 +32,24 @@ def deploy(args):
                 config["vis_result_dir"] = "/".join(["./model", "vis_results", "image"])
             elif config["data_type"] == "video":
                 config["vis_result_dir"] = "/".join(["./model", "vis_results", "video"])
+                config["batch_size"] = 1
             os.makedirs(config["vis_result_dir"], exist_ok=True)
+        elif phase == "export":
+            config["export_dir"] = "/".join(["./model", "export"])
+            os.makedirs(config["export_dir"], exist_ok=True)
+        elif phase == "prune":
+            config["pruned_arch"] = None
+            config["input_size"] = None
+            config["pruned_dir"] = "/".join(["./model", "pruned"])
+            config["pruned_ckpt_dir"] = "/".join(["./model", "pruned_checkpoints"])
+            os.makedirs(config["pruned_dir"], exist_ok=True)
+        elif phase in ["quantize", "serve"]:
+            config["export_dir"] = "/".join(["./model", "export"])
         else:
             raise ValueError('Unexpected phase')
+    # parallelism of the data pipeline and the session tuned for this host by --autotune. a config may set them explicitly
+    for key, value in load_profile(phase).items():
+        config.setdefault(key, value)
     os.environ["CUDA_VISIBLE_DEVICES"] = str(config["physical_gpu_id"])
     config = Bunch(config)
     return config
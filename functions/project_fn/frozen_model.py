@@ -0,0 +1,42 @@
+import tensorflow as tf
+
+INPUT_NODE = "input_data"
+OUTPUT_NODES = ["pred", "prob"]
+
+
+class FrozenModel:
+    """
+    inference-only model loaded from a frozen graph written by phase=export
+    """
+
+    def __init__(self, graph_def, session_config=None):
+        """
+        graph_def: either a tf.GraphDef or a path to a frozen .pb file
+        """
+        if not isinstance(graph_def, tf.GraphDef):
+            graph_def = self.load_graph_def(graph_def)
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+        self.input_data = self.graph.get_tensor_by_name(INPUT_NODE + ":0")
+        self.outputs = {name: self.graph.get_tensor_by_name(name + ":0") for name in OUTPUT_NODES}
+        self.sess = tf.Session(graph=self.graph, config=session_config)
+
+    @staticmethod
+    def load_graph_def(path):
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(path, "rb") as reader:
+            graph_def.ParseFromString(reader.read())
+        return graph_def
+
+    def run(self, images, fetch="pred"):
+        """
+        images: uint8 RGB array of [batch, height, width, 3]
+        fetch: an output node name or a list of output node names
+        """
+        if isinstance(fetch, str):
+            return self.sess.run(self.outputs[fetch], {self.input_data: images})
+        return self.sess.run([self.outputs[name] for name in fetch], {self.input_data: images})
+
+    def close(self):
+        self.sess.close()
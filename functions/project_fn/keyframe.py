@@ -0,0 +1,103 @@
+import cv2 as cv
+import numpy as np
+import time
+
+
+class KeyframePropagator:
+    """
+    runs the network only on keyframes of a video and warps the last keyframe mask to the frames in between.
+
+    a frame becomes a keyframe if
+    - keyframe_max_gap frames have passed since the last keyframe
+    - its mean absolute difference from the last keyframe exceeds keyframe_diff_threshold
+    - the last keyframe warped by the estimated motion still differs from it by more than keyframe_max_warp_error
+    - it is a validation frame. the network has run on it anyway, so its exact mask is kept
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.key_gray = None
+        self.key_pred = None
+        self.gap = 0
+        self.num_frames = 0
+        self.num_keyframes = 0
+        self.num_network_runs = 0
+        self.network_time = 0.0
+        self.propagation_time = 0.0  # motion estimation, frame difference and warping, which an every-frame run skips
+        self.validation_iou = []
+
+    def _motion_gray(self, frame):
+        scale = self.config.keyframe_motion_scale
+        return cv.cvtColor(cv.resize(frame, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA), cv.COLOR_BGR2GRAY)
+
+    def _run_network(self, predict_fn, frame):
+        start_time = time.time()
+        pred = predict_fn(frame)
+        self.network_time += time.time() - start_time
+        self.num_network_runs += 1
+        return pred
+
+    def _set_keyframe(self, gray, pred):
+        self.key_gray = gray
+        self.key_pred = pred.astype(np.uint8)
+        self.gap = 0
+        self.num_keyframes += 1
+        return pred
+
+    def _warp(self, gray, frame_shape):
+        # backward flow from the current frame to the keyframe, so every current pixel samples the keyframe mask
+        flow = cv.calcOpticalFlowFarneback(gray, self.key_gray, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+        small_h, small_w = gray.shape
+        grid_x, grid_y = np.meshgrid(np.arange(small_w, dtype=np.float32), np.arange(small_h, dtype=np.float32))
+        warped_gray = cv.remap(self.key_gray, grid_x + flow[:, :, 0], grid_y + flow[:, :, 1], cv.INTER_LINEAR)
+        warp_error = np.mean(cv.absdiff(warped_gray, gray)) / 255.0
+
+        h, w = frame_shape[:2]
+        flow = cv.resize(flow, (w, h), interpolation=cv.INTER_LINEAR) / self.config.keyframe_motion_scale
+        grid_x, grid_y = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+        warped_pred = cv.remap(self.key_pred, grid_x + flow[:, :, 0], grid_y + flow[:, :, 1], cv.INTER_NEAREST)
+        return warped_pred, warp_error
+
+    def predict(self, frame, predict_fn):
+        """
+        frame: BGR frame of [height, width, 3]
+        predict_fn: runs the network on a frame and returns a prediction of [height, width]
+        """
+        self.num_frames += 1
+        start_time = time.time()
+        gray = self._motion_gray(frame)
+        if self.key_gray is None or self.gap >= self.config.keyframe_max_gap:
+            self.propagation_time += time.time() - start_time
+            return self._set_keyframe(gray, self._run_network(predict_fn, frame))
+
+        frame_diff = np.mean(cv.absdiff(gray, self.key_gray)) / 255.0
+        if frame_diff > self.config.keyframe_diff_threshold:
+            self.propagation_time += time.time() - start_time
+            return self._set_keyframe(gray, self._run_network(predict_fn, frame))
+
+        warped_pred, warp_error = self._warp(gray, frame.shape)
+        self.propagation_time += time.time() - start_time
+        if warp_error > self.config.keyframe_max_warp_error:
+            return self._set_keyframe(gray, self._run_network(predict_fn, frame))
+
+        self.gap += 1
+        if self.config.keyframe_validate_interval and not self.gap % self.config.keyframe_validate_interval:
+            pred = self._run_network(predict_fn, frame)
+            union = np.sum((pred != 0) | (warped_pred != 0))
+            iou = np.sum((pred != 0) & (warped_pred != 0)) / union if union else 1.0
+            self.validation_iou.append(iou)
+            return self._set_keyframe(gray, pred)
+        return warped_pred
+
+    def report(self, elapsed):
+        # every-frame baseline: the measured cost of a network run plus the per-frame work other than propagation,
+        # e.g. decoding, superimposing and encoding
+        network_sec_per_frame = self.network_time / max(self.num_network_runs, 1)
+        overhead_sec_per_frame = (elapsed - self.network_time - self.propagation_time) / max(self.num_frames, 1)
+        print("keyframes: %d/%d frames" % (self.num_keyframes, self.num_frames))
+        print("effective fps: %.2f, every-frame fps (estimated): %.2f" % (
+            self.num_frames / max(elapsed, 1e-9), 1.0 / max(network_sec_per_frame + overhead_sec_per_frame, 1e-9)))
+        if self.validation_iou:
+            print("propagated mask iou on %d validation frames: mean=%.4f, min=%.4f, below keyframe_min_iou=%d" % (
+                len(self.validation_iou), np.mean(self.validation_iou), np.min(self.validation_iou),
+                np.sum(np.array(self.validation_iou) < self.config.keyframe_min_iou)))
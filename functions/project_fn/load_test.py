@@ -0,0 +1,46 @@
+"""
+load test client for the inference server started by --phase serve
+
+usage: python -m functions.project_fn.load_test --image crack.jpg --concurrency 8 --num_requests 500
+"""
+from urllib.request import Request, urlopen
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import argparse
+import json
+import time
+
+
+def post_image(url, data):
+    start_time = time.time()
+    with urlopen(Request(url, data, {"Content-Type": "application/octet-stream"})) as response:
+        result = json.loads(response.read().decode("utf-8"))
+    return (time.time() - start_time) * 1000.0, result
+
+
+def run_load_test(url, data, concurrency, num_requests):
+    start_time = time.time()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda _: post_image(url, data), range(num_requests)))
+    elapsed = time.time() - start_time
+    latencies = np.array([latency for latency, _ in results])
+    queue_ms = np.array([result["queue_ms"] for _, result in results])
+    print("requests=%d, concurrency=%d, throughput=%.2f images/sec" % (num_requests, concurrency, num_requests / elapsed))
+    print("client latency (ms): mean=%.2f, p50=%.2f, p90=%.2f, p99=%.2f, max=%.2f" % (
+        latencies.mean(), *np.percentile(latencies, [50, 90, 99]), latencies.max()))
+    print("server queue (ms): mean=%.2f, p99=%.2f" % (queue_ms.mean(), np.percentile(queue_ms, 99)))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--url', type=str, default='http://127.0.0.1:8500')
+    argparser.add_argument('--image', type=str, required=True, help='jpg/png image sent in every request')
+    argparser.add_argument('--concurrency', type=int, default=8)
+    argparser.add_argument('--num_requests', type=int, default=200)
+    args = argparser.parse_args()
+
+    with open(args.image, "rb") as reader:
+        image_data = reader.read()
+    run_load_test(args.url + "/segment", image_data, args.concurrency, args.num_requests)
+    with urlopen(args.url + "/metrics") as response:
+        print(json.dumps(json.loads(response.read().decode("utf-8")), indent=2))
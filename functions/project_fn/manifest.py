@@ -0,0 +1,96 @@
+"""
+file manifest behind list_getter.
+directories are scanned in parallel with os.scandir and the listing of each directory is cached with its mtime,
+so listing a tree again only rescans the directories whose entries have changed
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import time
+
+MANIFEST_DIR = "./model/manifest"
+NUM_THREADS = 16  # directories scanned at the same time. network file systems hide latency with more threads
+MTIME_SAFETY_SEC = 2  # a directory modified this recently may change again within the same mtime tick, so it is not cached
+
+
+def _scan_dir(path, cached):
+    """
+    returns (mtime, file names, subdirectory names, is_cached) of a directory.
+    the cached listing is reused if the mtime of the directory is unchanged
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None, [], [], False
+    if cached and cached["mtime"] == mtime:
+        return mtime, cached["files"], cached["dirs"], True
+    files = []
+    dirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                # as os.walk, symbolic links to directories are neither files nor walked into
+                if not is_dir:
+                    files.append(entry.name)
+                elif not entry.is_symlink():
+                    dirs.append(entry.name)
+    except OSError:
+        return None, [], [], False
+    if time.time_ns() - mtime < MTIME_SAFETY_SEC * 10 ** 9:
+        mtime = None
+    return mtime, files, dirs, False
+
+
+def _manifest_path(dir_name):
+    key = hashlib.md5(os.path.abspath(dir_name).encode()).hexdigest()
+    return os.path.join(MANIFEST_DIR, "%s.json" % key)
+
+
+def _load_manifest(manifest_path):
+    try:
+        with open(manifest_path) as reader:
+            return json.load(reader)["dirs"]
+    except (OSError, ValueError, KeyError):
+        return dict()  # no manifest yet or a broken one. it is rebuilt
+
+
+def _save_manifest(manifest_path, dir_name, dirs):
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    # written to a temporary file first so that processes listing the same tree never read a partial manifest
+    tmp_path = "%s.%d.tmp" % (manifest_path, os.getpid())
+    with open(tmp_path, "w") as writer:
+        json.dump({"root": os.path.abspath(dir_name), "dirs": dirs}, writer)
+    os.replace(tmp_path, manifest_path)
+
+
+def scan_tree(dir_name, use_cache=True, num_threads=NUM_THREADS):
+    """
+    returns the paths of all files under dir_name in the same form as os.walk: os.path.join(dir_name, subdirectory, name)
+
+    use_cache: False for scanning every directory without reading or writing the manifest
+    """
+    manifest_path = _manifest_path(dir_name)
+    cached_dirs = _load_manifest(manifest_path) if use_cache else dict()
+    scanned_dirs = dict()
+    is_changed = False
+    file_list = []
+    with ThreadPoolExecutor(num_threads) as executor:
+        level = [""]  # directories relative to dir_name. one level of the tree is scanned at a time
+        while level:
+            results = executor.map(lambda rel_path: _scan_dir(os.path.join(dir_name, rel_path), cached_dirs.get(rel_path)), level)
+            next_level = []
+            for rel_path, (mtime, files, dirs, is_cached) in zip(level, results):
+                scanned_dirs[rel_path] = {"mtime": mtime, "files": files, "dirs": dirs}
+                is_changed = is_changed or not is_cached
+                path = os.path.join(dir_name, rel_path)
+                file_list.extend(os.path.join(path, name) for name in files)
+                next_level.extend(os.path.join(rel_path, name) for name in dirs)
+            level = next_level
+    if use_cache and (is_changed or len(scanned_dirs) != len(cached_dirs)):
+        _save_manifest(manifest_path, dir_name, scanned_dirs)
+    return file_list
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+def rle_encode(mask):
+    """
+    run-length encoding of a binary mask in row-major order.
+    counts alternate between background and crack runs, starting with a (possibly empty) background run
+
+    mask: array of [height, width]. nonzero pixels are regarded as crack
+    """
+    flat = mask.reshape(-1) != 0
+    if not flat.size:
+        return np.zeros([0], np.int64)
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate([[0], change, [flat.size]]))
+    if flat[0]:
+        counts = np.concatenate([[0], counts])
+    return counts
+
+
+def rle_decode(counts, shape):
+    values = (np.arange(len(counts)) % 2).astype(np.uint8)
+    return np.repeat(values, counts).reshape(shape)
+
+
+def bitpack_encode(mask):
+    """
+    packs a binary mask into 8 pixels per byte in row-major order
+    """
+    return np.packbits(mask.reshape(-1) != 0)
+
+
+def bitpack_decode(packed, shape):
+    return np.unpackbits(packed, count=int(np.prod(shape))).reshape(shape)
+
+
+def save_mask(path, mask, encoding):
+    """
+    saves a binary mask as a compact .npz file
+
+    encoding: either rle or bitpack
+    """
+    if encoding == "rle":
+        data = rle_encode(mask).astype(np.uint32)
+    elif encoding == "bitpack":
+        data = bitpack_encode(mask)
+    else:
+        raise ValueError("Unexpected mask encoding: %s" % encoding)
+    np.savez(path, encoding=encoding, shape=np.array(mask.shape[:2], np.int64), data=data)
+
+
+def load_mask(path):
+    with np.load(path) as saved:
+        encoding = str(saved["encoding"])
+        shape = tuple(saved["shape"])
+        if encoding == "rle":
+            return rle_decode(saved["data"], shape)
+        elif encoding == "bitpack":
+            return bitpack_decode(saved["data"], shape)
+        raise ValueError("Unexpected mask encoding: %s" % encoding)
@@ -1,10 +1,15 @@
-from functions.project_fn.utils import get_shape, list_getter
-from cv2 import VideoCapture, VideoWriter, VideoWriter_fourcc, imwrite
+from functions.project_fn.frozen_model import FrozenModel, INPUT_NODE, OUTPUT_NODES
+from functions.project_fn.utils import get_shape, list_getter, imread_rgb, superimpose
+from functions.project_fn.mask_codec import save_mask
+from functions.project_fn.prune import find_conv_blocks, select_channels, prune_variables, save_variables
 from functions.project_fn.module import Module
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 from math import pi, isnan, isinf
-import horovod.tensorflow as hvd
 import numpy as np
 import tensorflow as tf
+import threading
+import json
 import os
 import time
 
@@ -72,7 +77,52 @@ class TrainHandler:
             raise ValueError('The above variables have no gradient')
         self.train_op = optimizer.apply_gradients(self.grads_and_vars, global_step=self.global_step)
 
-    def _train_step(self, graph, sess, saver):
+    def _build_validation(self):
+        # inference path of a small validation set. it shares the variables of the train path
+        self.val_input = tf.placeholder(tf.uint8, [1, None, None, 3])
+        self.val_gt = tf.placeholder(tf.uint8, [1, None, None])
+        self.val_set = None  # decoded on the first validation and kept in memory
+        # batch norm uses the moving statistics and recompute_grad is skipped as in phase=eval
+        self.config.is_train = False
+        try:
+            val_logit = self._forward(self.val_input, reuse=True)
+        finally:
+            self.config.is_train = True
+        num_classes = self.config.num_classes
+        val_gt = tf.cast(self.val_gt, tf.int32)
+        with tf.control_dependencies(self._gt_range_asserts(val_gt)):
+            index = val_gt * num_classes + tf.cast(tf.argmax(val_logit, 3), tf.int32)
+        self.val_confusion_matrix = tf.reshape(tf.math.bincount(tf.reshape(index, [-1]),
+                                                                minlength=num_classes ** 2,
+                                                                maxlength=num_classes ** 2,
+                                                                dtype=tf.int64), [num_classes, num_classes])
+
+    def _validate(self, sess, summary_writer, global_step):
+        if self.val_set is None:
+            from cv2 import imread, IMREAD_GRAYSCALE
+            img_list = list_getter(self.config.val_img_dir, "jpg")
+            gt_list = list_getter(self.config.val_seg_dir, "png")
+            if not img_list or not len(img_list) == len(gt_list):
+                raise ValueError("Unexpected validation set: %d images, %d ground truth" % (len(img_list), len(gt_list)))
+            self.val_set = [(imread_rgb(img_name), imread(gt_name, IMREAD_GRAYSCALE)) for img_name, gt_name in zip(img_list, gt_list)]
+        start_time = time.time()
+        cmatrix = np.zeros((self.config.num_classes, self.config.num_classes), np.int64)
+        for image, gt in self.val_set:
+            cmatrix += sess.run(self.val_confusion_matrix, {self.val_input: np.expand_dims(image, 0), self.val_gt: np.expand_dims(gt, 0)})
+        metrics = self._segmentation_metric(cmatrix)
+        metric_names = ["precision", "recall", "f1", "miou"] if self.config.num_classes <= 2 else ["miou"]
+        summary_writer.add_summary(tf.Summary(value=[tf.Summary.Value(tag="validation/%s" % name, simple_value=value)
+                                                     for name, value in zip(metric_names, metrics)]), global_step)
+        log_path = os.path.join(self.config.ckpt_dir, "validation.csv")
+        is_new = not os.path.exists(log_path)
+        with open(log_path, "a") as writer:
+            if is_new:
+                writer.write("ckpt_id, " + ", ".join(metric_names) + "\n")
+            writer.write("model_step-%d, " % global_step + ", ".join([str(value) for value in metrics]) + "\n")
+        print("validation at step=%d(%.3f sec): %s" % (global_step, time.time() - start_time,
+                                                       ", ".join(["%s=%.5f" % pair for pair in zip(metric_names, metrics)])))
+
+    def _train_step(self, graph, sess, saver, is_chief):
         summary_op = tf.summary.merge_all()
         summary_writer = tf.summary.FileWriter(logdir=self.config.ckpt_dir, graph=graph)
 
@@ -103,6 +153,9 @@ class TrainHandler:
                 summary_writer.add_summary(sess.run(summary_op), global_step)
                 print("summary is saved")
             #
+            if self.config.val_interval and not global_step % self.config.val_interval and is_chief:
+                self._validate(sess, summary_writer, global_step)
+            #
             if should_terminate:
                 raise ValueError('Model diverged with loss = %s' % batch_loss)
 
@@ -121,10 +174,16 @@ class TrainHandler:
                 print('Training will be continued from the last checkpoint...')
                 saver.restore(sess, all_ckpt_list[-1])
                 print('The last checkpoint is loaded!')
+            elif self.config.init_ckpt:
+                # e.g. fine-tuning a pruned model. variables missing in init_ckpt such as momentum keep their initial values
+                print('Training will be started from %s...' % self.config.init_ckpt)
+                reader = tf.train.load_checkpoint(self.config.init_ckpt)
+                init_saver = tf.train.Saver([var for var in tf.global_variables() if reader.has_tensor(var.op.name)])
+                init_saver.restore(sess, self.config.init_ckpt)
             else:
                 print('Training will be started from scratch...')
             sess.run(hvd.broadcast_global_variables(0))
-            self._train_step(graph, sess, saver)
+            self._train_step(graph, sess, saver, hvd.rank() == 0)
 
     def _train_handler(self, hvd, sess):
         self._miou_loss()
@@ -146,6 +205,8 @@ class TrainHandler:
         with tf.control_dependencies(update_ops):
             self._build_train_op(optimizer)
         self._build_summary_op()
+        if self.config.val_interval:
+            self._build_validation()
         self._start_train(hvd, sess)
 
 
@@ -155,7 +216,7 @@ class EvalHandler:
     """
 
     def _init_log(self):
-        with open(os.path.join(self.config.eval_log_dir, 'metric_overall.csv'), 'a+') as writer:
+        with open(os.path.join(self.config.eval_log_dir, 'metric_overall%s.csv' % self.log_tag), 'a+') as writer:
             writer.seek(0)  # python 3, this line must be included. it's a python bug.
             log = writer.readlines()
             if not log:
@@ -169,7 +230,7 @@ class EvalHandler:
 
     def _get_ckpt_in_range(self):
         all_ckpt_list = [_.split(".index")[0] for _ in list_getter(self.config.ckpt_dir, 'index')]
-        ckpt_pattern = './model/checkpoints/model_step-%d'
+        ckpt_pattern = self.config.ckpt_dir + '/model_step-%d'
         if self.config.ckpt_start == 'beginning':
             start_idx = 0
         else:
@@ -181,51 +242,215 @@ class EvalHandler:
             end_idx = all_ckpt_list.index(ckpt_pattern % self.config.ckpt_end) + 1
         return all_ckpt_list[start_idx:end_idx:self.config.ckpt_step]
 
-    def _calculate_segmentation_metric(self):
-        tp = np.diag(self.cumulative_cmatrix)
-        fp = np.sum(self.cumulative_cmatrix, axis=0) - tp
-        fn = np.sum(self.cumulative_cmatrix, axis=1) - tp
+    @staticmethod
+    def _segmentation_metric(cmatrix):
+        tp = np.diag(cmatrix)
+        fp = np.sum(cmatrix, axis=0) - tp
+        fn = np.sum(cmatrix, axis=1) - tp
         precision = tp / (tp + fp)  # precision of each class. [batch, class]
         recall = tp / (tp + fn)  # recall of each class. [batch, class]
         f1 = 2 * precision * recall / (precision + recall)
         iou = tp / (tp + fp + fn)  # iou of each class. [batch, class]
         miou = iou.mean()  # miou
         if iou.shape[0] <= 2:
-            self.metrics = [precision[1], recall[1], f1[1], miou]
+            return [precision[1], recall[1], f1[1], miou]
         else:
-            self.metrics = [miou]
+            return [miou]
+
+    def _confusion_matrix(self, gt, pred):
+        # [gt class, predicted class] pixel counts of a prediction of any shape
+        num_classes = self.config.num_classes
+        return np.bincount(gt.astype(np.int64).reshape(-1) * num_classes + pred.astype(np.int64).reshape(-1),
+                           minlength=num_classes ** 2).reshape(num_classes, -1)
+
+    def _evaluate_files(self, predict_fn, img_list, gt_list):
+        """
+        confusion matrix and sec/image of predict_fn over image files and their ground truth
+
+        predict_fn: a function taking a uint8 RGB image of [height, width, 3] and returning a prediction of [height, width]
+        """
+        from cv2 import imread, IMREAD_GRAYSCALE
+        cmatrix = np.zeros((self.config.num_classes, self.config.num_classes), np.int64)
+        elapsed = 0.0
+        for img_name, gt_name in zip(img_list, gt_list):
+            image = imread_rgb(img_name)
+            gt = imread(gt_name, IMREAD_GRAYSCALE)
+            start_time = time.time()
+            pred = predict_fn(image)
+            elapsed += time.time() - start_time
+            cmatrix += self._confusion_matrix(gt, pred)
+        return cmatrix, elapsed / max(len(img_list), 1)
+
+    def _calculate_segmentation_metric(self):
+        self.metrics = self._segmentation_metric(self.cumulative_cmatrix)
 
     def _write_eval_log(self, ckpt_id):
-        with open(os.path.join(self.config.eval_log_dir, 'metric_overall.csv'), 'a+') as writer:
+        with open(os.path.join(self.config.eval_log_dir, 'metric_overall%s.csv' % self.log_tag), 'a+') as writer:
             writer.write('%s, ' % ckpt_id)
             writer.write(', '.join([str(value) for value in self.metrics]) + '\n')
+        # latency and metrics of every tta set are gathered in one file to compare them
+        log_path = os.path.join(self.config.eval_log_dir, 'metric_tta.csv')
+        is_new = not os.path.exists(log_path)
+        with open(log_path, 'a+') as writer:
+            if is_new:
+                if self.config.num_classes <= 2:
+                    writer.write('ckpt_id, tta, sec/image, precision, recall, f1, miou\n')
+                else:
+                    writer.write('ckpt_id, tta, sec/image, miou\n')
+            writer.write('%s, %s, %s, ' % (ckpt_id, "-".join(self.tta) if self.tta else "none", self.sec_per_image))
+            writer.write(', '.join([str(value) for value in self.metrics]) + '\n')
+
+    def _build_threshold_histogram(self):
+        # histograms of the crack probability of crack and background pixels.
+        # bin k holds probabilities in [k / num_thresholds, (k + 1) / num_thresholds)
+        prob = tf.nn.softmax(tf.cast(self.logit, tf.float32))[:, :, :, 1]
+        is_crack = tf.equal(tf.squeeze(self.gt, 3), 1)
+        is_valid = self._valid_mask()
+        value_range = [0.0, 1.0]
+        crack_histogram = tf.histogram_fixed_width(tf.boolean_mask(prob, tf.logical_and(is_crack, is_valid)),
+                                                   value_range, self.config.num_thresholds, tf.int64)
+        background_histogram = tf.histogram_fixed_width(tf.boolean_mask(prob, tf.logical_and(tf.logical_not(is_crack), is_valid)),
+                                                        value_range, self.config.num_thresholds, tf.int64)
+        return crack_histogram, background_histogram
+
+    def _build_streaming_metric(self):
+        # int64 accumulators live in the graph. they are updated by the forward pass and read once per checkpoint
+        def accumulator(name, shape):
+            return tf.Variable(tf.zeros(shape, tf.int64), trainable=False, name=name,
+                               collections=[tf.GraphKeys.LOCAL_VARIABLES])
+
+        # confusion matrix of each image in the batch: [batch, class, class]. padded pixels are not counted
+        num_classes = self.config.num_classes
+        gt = tf.cast(tf.squeeze(self.gt, 3), tf.int32)
+        pred = tf.cast(tf.argmax(self.logit, 3), tf.int32)
+        batch_size = tf.shape(gt)[0]
+        self.num_images = batch_size  # batches of group_by_window and the last batch may be partial
+        index = tf.reshape(tf.range(batch_size), [-1, 1, 1]) * num_classes ** 2 + gt * num_classes + pred
+        with tf.control_dependencies(self._gt_range_asserts(gt)):
+            index = tf.identity(index)
+        self.confusion_matrix = tf.reshape(tf.math.bincount(tf.reshape(index, [-1]),
+                                                            tf.reshape(tf.cast(self._valid_mask(), tf.int64), [-1]),
+                                                            batch_size * num_classes ** 2,
+                                                            batch_size * num_classes ** 2),
+                                           [batch_size, num_classes, num_classes])
+        with tf.variable_scope("streaming_metric"):
+            accumulators = [accumulator("confusion_matrix", [num_classes, num_classes])]
+            updates = [tf.reduce_sum(self.confusion_matrix, 0)]
+            if self.config.num_thresholds:
+                accumulators.append(accumulator("crack_histogram", [self.config.num_thresholds]))
+                accumulators.append(accumulator("background_histogram", [self.config.num_thresholds]))
+                updates.extend(self._build_threshold_histogram())
+        self.metric_accumulators = accumulators
+        self.metric_update_op = tf.group([tf.assign_add(variable, value) for variable, value in zip(accumulators, updates)])
+        self.metric_reset_op = tf.variables_initializer(accumulators)
+
+    def _calculate_threshold_metric(self):
+        # a pixel is predicted as crack at threshold k / num_thresholds if its probability falls in bin k or above
+        tp = np.cumsum(self.cumulative_crack_histogram[::-1])[::-1]
+        fp = np.cumsum(self.cumulative_background_histogram[::-1])[::-1]
+        fn = self.cumulative_crack_histogram.sum() - tp
+        precision = tp / np.maximum(tp + fp, 1)
+        recall = tp / np.maximum(tp + fn, 1)
+        f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-12)
+        iou = tp / np.maximum(tp + fp + fn, 1)
+        thresholds = np.arange(self.config.num_thresholds) / self.config.num_thresholds
+        self.threshold_metrics = np.stack([thresholds, precision, recall, f1, iou], 1)
+
+    def _write_threshold_log(self, ckpt_id):
+        with open(os.path.join(self.config.eval_log_dir, 'metric_threshold_%s%s.csv' % (ckpt_id, self.log_tag)), 'w') as writer:
+            writer.write('threshold, precision, recall, f1, iou\n')
+            for row in self.threshold_metrics:
+                writer.write(', '.join([str(value) for value in row]) + '\n')
+        best_f1 = self.threshold_metrics[np.argmax(self.threshold_metrics[:, 3])]
+        log_path = os.path.join(self.config.eval_log_dir, 'metric_best_threshold%s.csv' % self.log_tag)
+        is_new = not os.path.exists(log_path)
+        with open(log_path, 'a+') as writer:
+            if is_new:
+                writer.write('ckpt_id, threshold, precision, recall, f1, iou\n')
+            writer.write('%s, ' % ckpt_id)
+            writer.write(', '.join([str(value) for value in best_f1]) + '\n')
+        print('best f1=%.5f at threshold=%.3f' % (best_f1[3], best_f1[0]))
+
+    def _write_roi_log(self, ckpt_id, roi_cmatrix, roi_sec_per_image):
+        log_path = os.path.join(self.config.eval_log_dir, 'metric_roi%s.csv' % self.log_tag)
+        is_new = not os.path.exists(log_path)
+        with open(log_path, 'a+') as writer:
+            if is_new:
+                writer.write('ckpt_id, full sec/image, roi sec/image, speedup, skipped pixel ratio, precision, recall, f1, miou\n')
+            writer.write('%s, %s, %s, %s, %s, ' % (ckpt_id, self.sec_per_image, roi_sec_per_image,
+                                                   self.sec_per_image / max(roi_sec_per_image, 1e-9),
+                                                   self.roi_inference.skipped_ratio()))
+            writer.write(', '.join([str(value) for value in self._segmentation_metric(roi_cmatrix)]) + '\n')
+        print('roi inference: %.2fx speedup, %.2f%% pixels skipped' % (self.sec_per_image / max(roi_sec_per_image, 1e-9),
+                                                                       self.roi_inference.skipped_ratio() * 100))
 
     def _eval(self, sess, ckpt_id):
+        if self.config.per_image_metric:
+            # the per-image confusion matrix is already computed for the update, so fetching it is nearly free
+            fetches = [self.metric_update_op, self.num_images, self.confusion_matrix, self.filename]
+            per_image_writer = open(os.path.join(self.config.eval_log_dir, 'metric_per_image_%s%s.csv' % (ckpt_id, self.log_tag)), 'w')
+            if self.config.num_classes <= 2:
+                per_image_writer.write('filename, precision, recall, f1, miou\n')
+            else:
+                per_image_writer.write('filename, miou\n')
+        else:
+            fetches = [self.metric_update_op, self.num_images]
+        if self.config.roi_inference:
+            # the full resolution forward pass of the update is the baseline of the roi inference
+            fetches += [self.input_data, self.gt, self.height, self.width]
+            roi_cmatrix = np.zeros((self.config.num_classes, self.config.num_classes), np.int64)
+            roi_time = 0.0
+        forward_time = 0.0
+        num_images = 0
         while True:
             try:
-                self.cumulative_cmatrix += sess.run(self.confusion_matrix)
+                start_time = time.time()
+                result = sess.run(fetches)
+                forward_time += time.time() - start_time
+                num_images += result[1]
+                if self.config.per_image_metric:
+                    for cmatrix, filename in zip(result[2], result[3]):
+                        per_image_writer.write('%s, ' % os.path.basename(filename.decode("utf-8")))
+                        per_image_writer.write(', '.join([str(value) for value in self._segmentation_metric(cmatrix)]) + '\n')
+                if self.config.roi_inference:
+                    for image, gt, h, w in zip(*result[-4:]):
+                        start_time = time.time()
+                        pred = self.roi_inference.predict(image[:h, :w])
+                        roi_time += time.time() - start_time
+                        roi_cmatrix += self._confusion_matrix(gt[:h, :w, 0], pred)
             except tf.errors.OutOfRangeError:
+                self.sec_per_image = forward_time / max(num_images, 1)
+                accumulated = sess.run(self.metric_accumulators)
+                self.cumulative_cmatrix = accumulated[0]
                 self._calculate_segmentation_metric()
                 self._write_eval_log(ckpt_id)
+                if self.config.num_thresholds:
+                    self.cumulative_crack_histogram, self.cumulative_background_histogram = accumulated[1:]
+                    self._calculate_threshold_metric()
+                    self._write_threshold_log(ckpt_id)
+                if self.config.roi_inference:
+                    self._write_roi_log(ckpt_id, roi_cmatrix, roi_time / max(num_images, 1))
                 break
+        if self.config.per_image_metric:
+            per_image_writer.close()
 
     def _eval_handler(self, sess):
         restorer = tf.train.Saver()
-        pred = tf.expand_dims(tf.argmax(self.logit, 3), 3)
-        self.confusion_matrix = tf.confusion_matrix(tf.reshape(self.gt, [-1]),
-                                                    tf.reshape(pred, [-1]),
-                                                    self.config.num_classes,
-                                                    dtype=tf.float32)
+        if self.config.num_thresholds and not self.config.num_classes == 2:
+            raise ValueError("num_thresholds works only if num_classes is 2")
+        self.log_tag = "_tta-" + "-".join(self.tta) if self.tta else ""
+        self._build_streaming_metric()
         for ckpt in self._get_ckpt_in_range():
             self._init_log()
-            self.cumulative_cmatrix = np.zeros((self.config.num_classes, self.config.num_classes))
             ckpt_id = os.path.basename(ckpt)
             if ckpt_id in [row.split(',')[0] for row in self.log[1:]]:
                 print('Log for the current ckpt (%s) already exsit. This ckpt is skipped' % ckpt_id)
             else:
                 print('Current ckpt: %s' % ckpt)
                 restorer.restore(sess, ckpt)
-                sess.run(self.data_init)
+                sess.run([self.data_init, self.metric_reset_op])
+                if self.config.roi_inference:
+                    self._build_roi_inference(sess)
                 self._eval(sess, ckpt_id)
 
 
@@ -236,55 +461,151 @@ class VisHandler:
 
     def _get_ckpt(self):
         all_ckpt_list = [_.split(".index")[0] for _ in list_getter(self.config.ckpt_dir, 'index')]
-        ckpt_pattern = './model/checkpoints/model_step-%d'
+        ckpt_pattern = self.config.ckpt_dir + '/model_step-%d'
         return all_ckpt_list[all_ckpt_list.index(ckpt_pattern % self.config.ckpt_id)]
 
     def _superimpose(self, image, pred):
-        mask = np.ones_like(pred) - pred
-        color_label = np.stack([np.zeros_like(pred), np.zeros_like(pred), pred * 255], 2)
         if self.config.data_type == "image":
-            return image[:, :, ::-1] * np.expand_dims(mask, 2) + color_label
+            return superimpose(np.ascontiguousarray(image[:, :, ::-1]), pred)
         elif self.config.data_type == "video":
-            return image * np.expand_dims(mask, 2) + color_label
+            return superimpose(image, pred)
+
+    def _write_vis_result(self, image, pred, dst_name):
+        from cv2 import imwrite
+        stage_time = dict()
+        start_time = time.time()
+        if self.config.crack_geometry:
+            from functions.project_fn.crack_geometry import extract_crack_geometry
+            record = {"filename": os.path.basename(dst_name),
+                      "height": int(pred.shape[0]),
+                      "width": int(pred.shape[1]),
+                      "cracks": extract_crack_geometry(pred, self.config.crack_min_length, self.config.polyline_epsilon)}
+            with self.geometry_lock:
+                self.geometry_writer.write(json.dumps(record) + "\n")
+            stage_time["geometry"] = time.time() - start_time
+            start_time = time.time()
+        if self.config.vis_output == "overlay":
+            result = self._superimpose(image, pred)
+            stage_time["superimpose"] = time.time() - start_time
+            start_time = time.time()
+            imwrite(dst_name, result)
+        else:
+            save_mask(os.path.splitext(dst_name)[0] + ".npz", pred, self.config.vis_output)
+        stage_time["write"] = time.time() - start_time
+        return stage_time
 
     def _vis_with_image(self, sess):
-        while True:
-            try:
-                pred, image, filename = sess.run([self.pred,
-                                                  tf.squeeze(self.input_data),
-                                                  tf.squeeze(self.filename)])
-                basename = os.path.basename(filename.decode("utf-8"))
-                dst_name = self.config.vis_result_dir + "/" + basename
-                imwrite(dst_name, self._superimpose(image, pred))
-            except tf.errors.OutOfRangeError:
-                break
+        # superimpose and encoding run on a bounded thread pool so that the next forward pass does not wait on them.
+        # cv2 releases the GIL while encoding and writing
+        if self.config.roi_inference:
+            self._build_roi_inference(sess)
+            fetches = [self.input_data, self.filename, self.height, self.width]
+        else:
+            fetches = [self.pred, self.input_data, self.filename, self.height, self.width]
+        pending = deque()
+        stage_time = {"forward": 0.0}
+        num_images = 0
+        if self.config.crack_geometry:
+            self.geometry_lock = threading.Lock()
+            self.geometry_writer = open(os.path.join(self.config.vis_result_dir, "crack_geometry.jsonl"), "w")
+
+        def collect(future):
+            for stage, elapsed in future.result().items():
+                stage_time[stage] = stage_time.get(stage, 0.0) + elapsed
+
+        start_time = time.time()
+        with ThreadPoolExecutor(self.config.vis_writer_threads) as executor:
+            while True:
+                try:
+                    forward_start = time.time()
+                    batch = sess.run(fetches)
+                    if self.config.roi_inference:
+                        batch.insert(0, [self.roi_inference.predict(image[:h, :w]) for image, h, w in zip(batch[0], *batch[2:])])
+                    stage_time["forward"] += time.time() - forward_start
+                except tf.errors.OutOfRangeError:
+                    break
+                for pred, image, filename, h, w in zip(*batch):
+                    basename = os.path.basename(filename.decode("utf-8"))
+                    dst_name = self.config.vis_result_dir + "/" + basename
+                    if len(pending) >= self.config.vis_max_pending:
+                        collect(pending.popleft())
+                    # padding of size-bucketed batches is cropped off
+                    pending.append(executor.submit(self._write_vis_result, image[:h, :w], pred[:h, :w], dst_name))
+                    num_images += 1
+            for future in pending:
+                collect(future)
+        if self.config.crack_geometry:
+            self.geometry_writer.close()
+        elapsed = time.time() - start_time
+        print("%d images in %.2f sec (%.2f images/sec)" % (num_images, elapsed, num_images / max(elapsed, 1e-9)))
+        for stage, total in stage_time.items():
+            print("%s: %.4f sec/image" % (stage, total / max(num_images, 1)))
+        if self.config.roi_inference:
+            print("skipped pixels: %.2f%%" % (self.roi_inference.skipped_ratio() * 100))
 
     def _vis_with_video(self, sess):
+        from cv2 import VideoCapture, VideoWriter, VideoWriter_fourcc
+        from functions.project_fn.keyframe import KeyframePropagator
+
+        def predict_fn(frame):
+            return sess.run(self.pred, {self.input_data: np.expand_dims(frame, 0)})[0]
+
         vid_list = list_getter(self.config.img_dir, ("avi", "mp4"))
         for vid_name in vid_list:
             vid = VideoCapture(vid_name)
             fps = round(vid.get(5))
+            if self.config.video_keyframe:
+                propagator = KeyframePropagator(self.config)
+                predict = lambda frame: propagator.predict(frame, predict_fn)
+            else:
+                predict = predict_fn
+            start_time = time.time()
             should_continue, frame = vid.read()
             basename = os.path.basename(vid_name)[:-4]
             dst_name = self.config.vis_result_dir + "/" + basename + ".avi"
             h, w, _ = frame.shape
-            pred = sess.run(self.pred, {self.input_data: np.expand_dims(frame, 0)})
+            pred = predict(frame)
             superimposed = self._superimpose(frame, pred)
             vid_out = VideoWriter(dst_name, VideoWriter_fourcc(*"XVID"), fps, (w, h))
-            vid_out.write(superimposed.astype(np.uint8))
+            vid_out.write(superimposed)
             while should_continue:
                 should_continue, frame = vid.read()
                 if should_continue:
-                    pred = sess.run(self.pred, {self.input_data: np.expand_dims(frame, 0)})
+                    pred = predict(frame)
                     superimposed = self._superimpose(frame, pred)
-                    vid_out.write(superimposed.astype(np.uint8))
+                    vid_out.write(superimposed)
             vid_out.release()
+            if self.config.video_keyframe:
+                print("%s:" % basename)
+                propagator.report(time.time() - start_time)
+
+    def _vis_with_workers(self, sess):
+        # the restored weights are frozen once and written to a file that every worker loads
+        from functions.project_fn.parallel_vis import run_sharded_vis
+        if self.config.crack_geometry or self.config.roi_inference:
+            raise ValueError("crack_geometry and roi_inference are not supported with num_workers > 1")
+        self._build_output_node()
+        graph_def = self._freeze(sess, None)
+        weights_path = os.path.join(self.config.worker_weights_dir, "crack_segmentation_%d.pb" % os.getpid())
+        with open(weights_path, "wb") as writer:
+            writer.write(graph_def.SerializeToString())
+        try:
+            run_sharded_vis(weights_path,
+                            list_getter(self.config.img_dir, "jpg"),
+                            self.config.vis_result_dir,
+                            self.config.num_workers,
+                            self.config.worker_intra_op_threads,
+                            self.config.vis_output)
+        finally:
+            os.remove(weights_path)
 
     def _vis_handler(self, sess):
         restorer = tf.train.Saver()
-        self.pred = tf.squeeze(tf.argmax(self.logit, 3))
+        self.pred = tf.argmax(self.logit, 3)
         restorer.restore(sess, self._get_ckpt())
-        if self.config.data_type == "image":
+        if self.config.data_type == "image" and self.config.num_workers > 1:
+            self._vis_with_workers(sess)
+        elif self.config.data_type == "image":
             sess.run(self.data_init)
             self._vis_with_image(sess)
         elif self.config.data_type == "video":
@@ -293,15 +614,206 @@ class VisHandler:
             raise ValueError("Unexpected data_type")
 
 
-class ModelHandler(Module, TrainHandler, EvalHandler, VisHandler):
+class ExportHandler:
+    """
+    a parent class of ModelHandler
+    """
+
+    def _build_output_node(self):
+        logit = tf.cast(self.logit, tf.float32)
+        self.export_prob = tf.nn.softmax(logit, name="prob")
+        self.export_pred = tf.cast(tf.argmax(logit, 3), tf.uint8, name="pred")
+
+    def _freeze(self, sess, input_size):
+        """
+        input_size: [height, width] for a fixed input size. None for dynamic batch and input size
+        """
+        from tensorflow.tools.graph_transforms import TransformGraph
+        graph_def = tf.graph_util.convert_variables_to_constants(sess, sess.graph.as_graph_def(), OUTPUT_NODES)
+        if input_size:
+            strip_unused = 'strip_unused_nodes(type=uint8, shape="1,%d,%d,3")' % tuple(input_size)
+        else:
+            strip_unused = "strip_unused_nodes(type=uint8)"
+        # variable reads become Identity nodes after freezing. they must be removed so that
+        # batch norm can be folded into the preceding conv kernels
+        transforms = ["remove_device",
+                      strip_unused,
+                      "remove_nodes(op=Identity, op=CheckNumerics, op=StopGradient)",
+                      "fold_constants(ignore_errors=true)",
+                      "fold_batch_norms",
+                      "fold_old_batch_norms",
+                      "merge_duplicate_nodes",
+                      strip_unused,
+                      "sort_by_execution_order"]
+        frozen_graph_def = TransformGraph(graph_def, [INPUT_NODE], OUTPUT_NODES, transforms)
+        print("Frozen graph: %d nodes -> %d nodes" % (len(graph_def.node), len(frozen_graph_def.node)))
+        remaining_bn = [node.name for node in frozen_graph_def.node if node.op.startswith("FusedBatchNorm")]
+        if remaining_bn:
+            print("Batch norm nodes that could not be folded: %s" % ", ".join(remaining_bn))
+        return frozen_graph_def
+
+    def _check_export(self, sess, graph_def):
+        from cv2 import resize
+        frozen_model = FrozenModel(graph_def)
+        matched = 0
+        total = 0
+        for img_name in list_getter(self.config.check_dir, "jpg")[:self.config.check_num]:
+            image = imread_rgb(img_name)
+            if self.config.input_size:
+                image = resize(image, (self.config.input_size[1], self.config.input_size[0]))
+            image = np.expand_dims(image, 0)
+            expected = sess.run(self.export_pred, {self.input_data: image})
+            exported = frozen_model.run(image)
+            matched += np.sum(expected == exported)
+            total += expected.size
+        frozen_model.close()
+        if not total:
+            raise ValueError("no jpg images exist: %s" % self.config.check_dir)
+        agreement = matched / total
+        print("Mask agreement between the checkpoint and the exported graph: %.6f" % agreement)
+        if agreement < self.config.check_min_agreement:
+            raise ValueError("Exported masks differ from the checkpoint: agreement=%.6f" % agreement)
+
+    @staticmethod
+    def _write_saved_model(graph_def, export_path):
+        frozen_model = FrozenModel(graph_def)
+        # the builder saves and exports the default graph. it must be the frozen graph, not the checkpoint graph
+        with frozen_model.graph.as_default():
+            builder = tf.saved_model.Builder(export_path)
+            signature = tf.saved_model.predict_signature_def({INPUT_NODE: frozen_model.input_data}, frozen_model.outputs)
+            builder.add_meta_graph_and_variables(frozen_model.sess,
+                                                 [tf.saved_model.tag_constants.SERVING],
+                                                 {tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY: signature})
+            builder.save()
+        frozen_model.close()
+
+    def _export_handler(self, sess):
+        restorer = tf.train.Saver()
+        self._build_output_node()
+        ckpt = self._get_ckpt()
+        restorer.restore(sess, ckpt)
+        graph_def = self._freeze(sess, self.config.input_size)
+        if self.config.check_dir:
+            self._check_export(sess, graph_def)
+        export_path = os.path.join(self.config.export_dir, os.path.basename(ckpt))
+        if self.config.export_format == "frozen_graph":
+            with tf.gfile.GFile(export_path + ".pb", "wb") as writer:
+                writer.write(graph_def.SerializeToString())
+        elif self.config.export_format == "saved_model":
+            self._write_saved_model(graph_def, export_path)
+        else:
+            raise ValueError("Unexpected export_format: %s" % self.config.export_format)
+        print("Model is exported: %s" % export_path)
+
+
+class PruneHandler:
+    """
+    a parent class of ModelHandler
+    """
+
+    def _measure_frozen(self, graph_def):
+        # sec/image on random inputs of latency_size and metrics on the eval set
+        frozen_model = FrozenModel(graph_def)
+        images = np.random.randint(0, 256, [1] + list(self.config.latency_size) + [3], np.uint8)
+        frozen_model.run(images)  # warm up
+        start_time = time.time()
+        for _ in range(self.config.latency_repeat):
+            frozen_model.run(images)
+        latency = (time.time() - start_time) / self.config.latency_repeat
+        img_list = list_getter(self.config.img_dir, "jpg")[::self.config.img_step]
+        gt_list = list_getter(self.config.seg_dir, "png")[::self.config.img_step]
+        if not len(img_list) == len(gt_list):
+            raise ValueError("number of images are different")
+        cmatrix, _ = self._evaluate_files(lambda image: frozen_model.run(np.expand_dims(image, 0))[0], img_list, gt_list)
+        frozen_model.close()
+        return latency, self._segmentation_metric(cmatrix) if img_list else []
+
+    def _build_pruned_model(self, pruned_arch):
+        # the pruned architecture is built in a new graph with the same entry point
+        graph = tf.Graph()
+        with graph.as_default():
+            self.input_data = tf.placeholder(tf.uint8, [None, None, None, 3], name=INPUT_NODE)
+            self.pruned_arch = pruned_arch
+            self.architecture_fn()
+            self._build_output_node()
+            restorer = tf.train.Saver()
+        session_config = tf.ConfigProto(allow_soft_placement=True)
+        session_config.gpu_options.allow_growth = True
+        return tf.Session(graph=graph, config=session_config), restorer
+
+    def _write_prune_report(self, rows):
+        metric_names = ["precision", "recall", "f1", "miou"] if self.config.num_classes <= 2 else ["miou"]
+        with open(os.path.join(self.config.pruned_dir, "pruning_report.csv"), "w") as writer:
+            writer.write("model, params, sec/image, " + ", ".join(metric_names) + "\n")
+            for name, num_params, latency, metrics in rows:
+                writer.write("%s, %d, %s, " % (name, num_params, latency) + ", ".join([str(value) for value in metrics]) + "\n")
+
+    def _prune_handler(self, sess):
+        restorer = tf.train.Saver()
+        self._build_output_node()
+        ckpt = self._get_ckpt()
+        restorer.restore(sess, ckpt)
+        blocks = find_conv_blocks(sess.graph, self.channel_axis())
+        reader = tf.train.load_checkpoint(ckpt)
+        gammas = {scope: reader.get_tensor(block["batch_norm"][0]) for scope, block in blocks.items()}
+        kept_channels = select_channels(blocks, gammas, self.config.prune_ratio, self.config.min_keep_ratio)
+        values = prune_variables(reader, [var.op.name for var in tf.global_variables()], blocks, kept_channels)
+        pruned_arch = {scope: len(channels) for scope, channels in kept_channels.items()}
+
+        pruned_ckpt = os.path.join(self.config.pruned_dir, os.path.basename(ckpt))
+        save_variables(values, pruned_ckpt)
+        with open(pruned_ckpt + ".json", "w") as writer:
+            json.dump(pruned_arch, writer, indent=2, sort_keys=True)
+        var_shapes = reader.get_variable_to_shape_map()
+        num_params = int(sum(np.prod(var_shapes[name]) for name in values))
+        num_pruned_params = sum(value.size for value in values.values())
+        print("%d of %d conv_blocks are prunable. channels: %d -> %d" % (
+            sum(block["prunable"] for block in blocks.values()), len(blocks),
+            sum(block["out_depth"] for block in blocks.values()), sum(pruned_arch.values())))
+        print("Pruned model is saved: %s, architecture: %s.json" % (pruned_ckpt, pruned_ckpt))
+
+        rows = [["original", num_params] + list(self._measure_frozen(self._freeze(sess, None)))]
+        pruned_sess, restorer = self._build_pruned_model(pruned_arch)
+        restorer.restore(pruned_sess, pruned_ckpt)
+        rows.append(["pruned", num_pruned_params] + list(self._measure_frozen(self._freeze(pruned_sess, None))))
+        if self.config.finetuned_ckpt_id is not None:
+            restorer.restore(pruned_sess, os.path.join(self.config.pruned_ckpt_dir, "model_step-%d" % self.config.finetuned_ckpt_id))
+            rows.append(["finetuned", num_pruned_params] + list(self._measure_frozen(self._freeze(pruned_sess, None))))
+        pruned_sess.close()
+        self._write_prune_report(rows)
+        for name, _, latency, metrics in rows[1:]:
+            print("%s: params %d -> %d, %.4f -> %.4f sec/image, speedup=%.2fx" % (
+                name, num_params, num_pruned_params, rows[0][2], latency, rows[0][2] / latency))
+            if metrics:
+                print("%s: mIoU change: %+.5f" % (name, metrics[-1] - rows[0][3][-1]))
+
+
+class ModelHandler(Module, TrainHandler, EvalHandler, VisHandler, ExportHandler, PruneHandler):
+    # test-time augmentation: (forward transform, inverse transform) of [batch, height, width, channel] tensors
+    tta_transforms = {"identity": (lambda x: x, lambda x: x),
+                      "flip_lr": (lambda x: tf.reverse(x, [2]), lambda x: tf.reverse(x, [2])),
+                      "flip_ud": (lambda x: tf.reverse(x, [1]), lambda x: tf.reverse(x, [1])),
+                      "rot90": (lambda x: tf.image.rot90(x, 1), lambda x: tf.image.rot90(x, 3)),
+                      "rot180": (lambda x: tf.image.rot90(x, 2), lambda x: tf.image.rot90(x, 2)),
+                      "rot270": (lambda x: tf.image.rot90(x, 3), lambda x: tf.image.rot90(x, 1)),
+                      "transpose": (lambda x: tf.transpose(x, [0, 2, 1, 3]), lambda x: tf.transpose(x, [0, 2, 1, 3]))}
+
     def __init__(self, data, config):
         self.config = config
         super(ModelHandler, self).__init__()
         self.dtype = tf.float16 if self.config.dtype == "fp16" else tf.float32
+        self.data_format = self.config.data_format
+        self.tta = self.config.tta if self.config.phase in ["eval", "vis"] else None
         self.input_data = data.input_data  #
         self.gt = data.gt  # this will be none in case phase=vis, data_type=video
         self.filename = data.filename
+        self.height = data.height  # original image sizes of size-bucketed batches. None if inputs are not padded
+        self.width = data.width
         self.data_init = data.data_init
+        self.pruned_arch = None  # output depths of the conv_blocks of a model pruned by phase=prune
+        if self.config.pruned_arch:
+            with open(self.config.pruned_arch) as reader:
+                self.pruned_arch = json.load(reader)
         self._build_model()
 
     @staticmethod
@@ -327,15 +839,61 @@ class ModelHandler(Module, TrainHandler, EvalHandler, VisHandler):
             variable = tf.cast(variable, dtype)
         return variable
 
+    def _gt_range_asserts(self, gt):
+        # a label out of [0, num_classes) would be counted in another cell of a bincount confusion matrix
+        return [tf.debugging.assert_greater_equal(gt, 0, message="gt has a negative label"),
+                tf.debugging.assert_less(gt, self.config.num_classes, message="gt has a label >= num_classes")]
+
+    def _valid_mask(self):
+        # [batch, height, width] mask of the pixels that are not padding
+        n, h, w, _ = get_shape(self.logit)
+        if self.height is None:
+            return tf.ones([n, h, w], tf.bool)
+        rows = tf.less(tf.reshape(tf.range(h), [1, -1, 1]), tf.reshape(self.height, [-1, 1, 1]))
+        cols = tf.less(tf.reshape(tf.range(w), [1, 1, -1]), tf.reshape(self.width, [-1, 1, 1]))
+        return tf.logical_and(rows, cols)
+
+    def _build_roi_inference(self, sess):
+        from functions.project_fn.roi_inference import RoiInference
+        if not hasattr(self, "roi_prob"):
+            self.roi_prob = tf.nn.softmax(tf.cast(self.logit, tf.float32))[:, :, :, 1]
+        self.roi_inference = RoiInference(self.config, lambda images: sess.run(self.roi_prob, {self.input_data: images}))
+
+    def _tta_input(self, input_data):
+        # all transforms of the input are stacked in one batch so that they run in a single forward pass
+        for name in self.tta:
+            if name not in self.tta_transforms:
+                raise ValueError("Unexpected tta transform: %s" % name)
+        n, h, w, c = get_shape(input_data)
+        self.tta_input_shape = [h, w]
+        if set(self.tta) & {"rot90", "rot270", "transpose"}:
+            # transforms swapping height and width need a square input to be batched with the others
+            size = tf.maximum(h, w)
+            input_data = tf.image.pad_to_bounding_box(input_data, 0, 0, size, size)
+        return tf.concat([self.tta_transforms[name][0](input_data) for name in ["identity"] + self.tta], 0)
+
+    def _tta_merge(self, logit):
+        logits = tf.split(logit, len(self.tta) + 1, 0)
+        logits = [self.tta_transforms[name][1](logit) for name, logit in zip(["identity"] + self.tta, logits)]
+        logit = tf.add_n(logits) / len(logits)
+        return logit[:, :self.tta_input_shape[0], :self.tta_input_shape[1], :]
+
     def architecture_fn(self):
-        normalized_input = (tf.cast(self.input_data, self.dtype) / 127.5 - 1) * 1.3
-        with tf.device("/GPU:0"), tf.variable_scope("fp32_var", custom_getter=self.fp32_var_getter, use_resource=True, reuse=False):
+        self.logit = self._forward(self.input_data, reuse=False)
+
+    def _forward(self, input_data, reuse):
+        input_data = self._tta_input(input_data) if self.tta else input_data
+        normalized_input = (tf.cast(input_data, self.dtype) / 127.5 - 1) * 1.3
+        if self.data_format == "NCHW":
+            normalized_input = tf.transpose(normalized_input, [0, 3, 1, 2])
+        channel_axis = self.channel_axis()
+        with tf.device(self.config.device), tf.variable_scope("fp32_var", custom_getter=self.fp32_var_getter, use_resource=True, reuse=reuse):
             root = self.convolution(normalized_input, 5, 1, 16, "root")
             en1, fp_feature1 = self.down_scale(root, [16, 32], [5, 3], [1, 2], "encoder1")
-            net = self.shortcut(en1, root, 3, 2, get_shape(root)[-1] / 2, "shortcut_concat1")
+            net = self.shortcut(en1, root, 3, 2, get_shape(root)[channel_axis] / 2, "shortcut_concat1")
             en2, _ = self.down_scale(net, [16, 32, 48], [7, 5, 3], [1, 1, 2], "encoder2", True, 4)
             en3, fp_feature2 = self.down_scale(en2, [16, 32, 48, 64], [9, 7, 5, 3], [1, 1, 1, 2], "encoder3", True, 4)
-            net = self.shortcut(en3, en2, 3, 2, get_shape(en2)[-1] / 2, "shortcut_concat2")
+            net = self.shortcut(en3, en2, 3, 2, get_shape(en2)[channel_axis] / 2, "shortcut_concat2")
             en4, _ = self.down_scale(net, [16, 32, 48, 64, 80], [11, 9, 7, 5, 3], [1, 1, 1, 1, 2], "encoder4", True, 4)
             repeat = en4
             for j in range(4):
@@ -343,25 +901,42 @@ class ModelHandler(Module, TrainHandler, EvalHandler, VisHandler):
             net = self.upscale(repeat, fp_feature2, 4, 4, 24, "upsample1")
             net = self.convolution(net, 3, 1, 24, "decode1")
             net = self.upscale(net, fp_feature1, 4, 4, 16, "upsample2")
-            self.logit = self.get_logit(net, 3, 1)
+            logit = self.get_logit(net, 3, 1)
+        if self.data_format == "NCHW":
+            # loss, metric and vis ops work on NHWC logits
+            logit = tf.transpose(logit, [0, 2, 3, 1])
+        return self._tta_merge(logit) if self.tta else logit
 
     def _build_model(self):
-        hvd.init()
         # Using the Winograd non-fused algorithms provides a small performance boost.
         os.environ['TF_ENABLE_WINOGRAD_NONFUSED'] = '1'
 
         print("Deploying model to GPU:%d..." % self.config.physical_gpu_id)
+        start_time = time.time()
         session_config = tf.ConfigProto()
         session_config.gpu_options.allow_growth = True
         session_config.allow_soft_placement = True
-        session_config.gpu_options.visible_device_list = str(hvd.local_rank())
+        session_config.intra_op_parallelism_threads = self.config.intra_op_threads
+        session_config.inter_op_parallelism_threads = self.config.inter_op_threads
+        if self.config.phase == "train":
+            # horovod is only needed for distributed training. the other phases run on a single device
+            import horovod.tensorflow as hvd
+            hvd.init()
+            session_config.gpu_options.visible_device_list = str(hvd.local_rank())
         sess = tf.Session(config=session_config)
+        print("startup: session %.2f sec" % (time.time() - start_time))
+        start_time = time.time()
         self.architecture_fn()
+        print("startup: architecture_fn %.2f sec" % (time.time() - start_time))
         if self.config.phase == "train":
             self._train_handler(hvd, sess)
         elif self.config.phase == "eval":
             self._eval_handler(sess)
         elif self.config.phase == "vis":
             self._vis_handler(sess)
+        elif self.config.phase == "export":
+            self._export_handler(sess)
+        elif self.config.phase == "prune":
+            self._prune_handler(sess)
         else:
             raise ValueError("Unexpected phase:%s" % self.config.phase)
@@ -3,24 +3,83 @@ import tensorflow as tf
 
 
 class Module:
-    def get_kernel(self, target_tensor, kernel_size, kernel_depth, transpose=False):
-        in_channel = get_shape(target_tensor)[-1]
+    """
+    building blocks of the network.
+    self.data_format is either NHWC or NCHW. kernels are [height, width, in, out] in both, so checkpoints are compatible
+    self.pruned_arch is {variable scope: out_depth} of every conv_block of a pruned model. None for the original
+    """
+
+    def channel_axis(self):
+        return 1 if self.data_format == "NCHW" else 3
+
+    def get_strides(self, stride):
+        return [1, 1, stride, stride] if self.data_format == "NCHW" else [1, stride, stride, 1]
+
+    def get_kernel(self, target_tensor, kernel_size, kernel_depth, transpose=False, channel_axis=None):
+        in_channel = get_shape(target_tensor)[self.channel_axis() if channel_axis is None else channel_axis]
         if transpose:
             kernel_shape = [kernel_size, kernel_size, kernel_depth, in_channel]
         else:
             kernel_shape = [kernel_size, kernel_size, in_channel, kernel_depth]
 
-        if self.config.weight_decay:
-            regularizer = tf.contrib.layers.l2_regularizer(scale=self.config.weight_decay)
-        else:
-            regularizer = None
-        return tf.get_variable("kernel", kernel_shape, self.dtype, tf.initializers.he_uniform(), regularizer, True)
+        return tf.get_variable("kernel", kernel_shape, self.dtype, tf.initializers.he_uniform(), self.get_regularizer(), True)
+
+    def get_depthwise_kernel(self, target_tensor, kernel_size):
+        in_channel = get_shape(target_tensor)[self.channel_axis()]
+        kernel_shape = [kernel_size, kernel_size, in_channel, 1]
+        return tf.get_variable("depthwise_kernel", kernel_shape, self.dtype, tf.initializers.he_uniform(), self.get_regularizer(), True)
+
+    def get_regularizer(self):
+        if self.config.is_train and self.config.weight_decay:
+            return tf.contrib.layers.l2_regularizer(scale=self.config.weight_decay)
+        return None
 
     def conv_block(self, tensor_in, kernel_size, stride, out_depth):
+        if self.pruned_arch:
+            out_depth = self.pruned_arch[tf.get_variable_scope().name]
+        # the efficient variant replaces large dense kernels with cheaper ones of the same receptive field
+        if self.config.efficient and kernel_size >= self.config.efficient_min_kernel:
+            if self.config.efficient == "dilated" and stride == 1:
+                return self.dilated_conv_block(tensor_in, kernel_size, out_depth)
+            elif self.config.efficient in ["separable", "dilated"]:
+                return self.separable_conv_block(tensor_in, kernel_size, stride, out_depth)
+            raise ValueError("Unexpected efficient: %s" % self.config.efficient)
+
         def build(main_pipe):
             kernel = self.get_kernel(main_pipe, kernel_size, out_depth)
-            main_pipe = tf.nn.conv2d(main_pipe, kernel, [1, stride, stride, 1], "SAME")
-            main_pipe = tf.layers.batch_normalization(main_pipe, training=self.config.is_train, fused=True)
+            main_pipe = tf.nn.conv2d(main_pipe, kernel, self.get_strides(stride), "SAME", data_format=self.data_format)
+            main_pipe = tf.layers.batch_normalization(main_pipe, axis=self.channel_axis(), training=self.config.is_train, fused=True)
+            main_pipe = tf.nn.elu(main_pipe)
+            return main_pipe
+
+        if self.config.is_train:
+            build = tf.contrib.layers.recompute_grad(build)
+        return build(tensor_in)
+
+    def separable_conv_block(self, tensor_in, kernel_size, stride, out_depth):
+        # depthwise kernel_size x kernel_size conv followed by a pointwise 1x1 conv
+        def build(main_pipe):
+            depthwise_kernel = self.get_depthwise_kernel(main_pipe, kernel_size)
+            pointwise_kernel = self.get_kernel(main_pipe, 1, out_depth)
+            main_pipe = tf.nn.separable_conv2d(main_pipe, depthwise_kernel, pointwise_kernel, self.get_strides(stride), "SAME",
+                                               data_format=self.data_format)
+            main_pipe = tf.layers.batch_normalization(main_pipe, axis=self.channel_axis(), training=self.config.is_train, fused=True)
+            main_pipe = tf.nn.elu(main_pipe)
+            return main_pipe
+
+        if self.config.is_train:
+            build = tf.contrib.layers.recompute_grad(build)
+        return build(tensor_in)
+
+    def dilated_conv_block(self, tensor_in, kernel_size, out_depth):
+        # 3x3 conv dilated to cover kernel_size x kernel_size. only for stride 1
+        rate = (kernel_size - 1) // 2
+
+        def build(main_pipe):
+            kernel = self.get_kernel(main_pipe, 3, out_depth)
+            main_pipe = tf.nn.conv2d(main_pipe, kernel, [1, 1, 1, 1], "SAME", data_format=self.data_format,
+                                     dilations=self.get_strides(rate))
+            main_pipe = tf.layers.batch_normalization(main_pipe, axis=self.channel_axis(), training=self.config.is_train, fused=True)
             main_pipe = tf.nn.elu(main_pipe)
             return main_pipe
 
@@ -29,10 +88,17 @@ class Module:
         return build(tensor_in)
 
     def transpose_conv_block(self, tensor_in, kernel_size, stride, out_depth, out_shape):
+        """
+        out_shape: [batch, height, width, depth] regardless of data_format
+        """
+        if self.data_format == "NCHW":
+            out_shape = [out_shape[0], out_shape[3], out_shape[1], out_shape[2]]
+
         def build(main_pipe):
             kernel = self.get_kernel(main_pipe, kernel_size, out_depth, transpose=True)
-            main_pipe = tf.nn.conv2d_transpose(main_pipe, kernel, out_shape, [1, stride, stride, 1], 'SAME')
-            main_pipe = tf.layers.batch_normalization(main_pipe, training=self.config.is_train, fused=True)
+            main_pipe = tf.nn.conv2d_transpose(main_pipe, kernel, out_shape, self.get_strides(stride), 'SAME',
+                                               data_format=self.data_format)
+            main_pipe = tf.layers.batch_normalization(main_pipe, axis=self.channel_axis(), training=self.config.is_train, fused=True)
             main_pipe = tf.nn.elu(main_pipe)
             return main_pipe
 
@@ -45,25 +111,35 @@ class Module:
         def build(main_pipe):
             with tf.variable_scope(scope):
                 with tf.variable_scope('context'):
-                    n, h, w, c = get_shape(main_pipe)
-                    tensor_in_flatten = tf.reshape(main_pipe, [n, h * w, c])
                     kernel = self.get_kernel(main_pipe, 1, 1)
-                    context = tf.nn.conv2d(main_pipe, kernel, strides=[1, 1, 1, 1], padding='SAME')
-                    context = tf.reshape(context, [n, h * w, 1])
-                    context = tf.nn.softmax(context, axis=1)
-                    context = tf.matmul(tensor_in_flatten, context, transpose_a=True)
+                    context = tf.nn.conv2d(main_pipe, kernel, strides=[1, 1, 1, 1], padding='SAME', data_format=self.data_format)
+                    if self.data_format == "NCHW":
+                        n, c, h, w = get_shape(main_pipe)
+                        tensor_in_flatten = tf.reshape(main_pipe, [n, c, h * w])
+                        context = tf.reshape(context, [n, h * w, 1])
+                        context = tf.nn.softmax(context, axis=1)
+                        context = tf.matmul(tensor_in_flatten, context)
+                    else:
+                        n, h, w, c = get_shape(main_pipe)
+                        tensor_in_flatten = tf.reshape(main_pipe, [n, h * w, c])
+                        context = tf.reshape(context, [n, h * w, 1])
+                        context = tf.nn.softmax(context, axis=1)
+                        context = tf.matmul(tensor_in_flatten, context, transpose_a=True)
+                    # the transform works on a 1x1 map, so it always runs in NHWC to keep its layer norm parameters
                     context = tf.reshape(context, [n, 1, 1, c])
 
                 with tf.variable_scope('transform'):
                     with tf.variable_scope('shrink'):
-                        kernel = self.get_kernel(context, 1, int(c / factor))
+                        kernel = self.get_kernel(context, 1, int(c / factor), channel_axis=3)
                         transform = tf.nn.conv2d(context, kernel, [1, 1, 1, 1], 'SAME')
                         transform = tf.contrib.layers.layer_norm(transform, center=True, scale=True, scope=scope)
                         transform = tf.nn.relu(transform)
                     with tf.variable_scope('expand'):
-                        kernel = self.get_kernel(transform, 1, c)
+                        kernel = self.get_kernel(transform, 1, c, channel_axis=3)
                         transform = tf.nn.conv2d(transform, kernel, [1, 1, 1, 1], 'SAME')
                         transform = tf.nn.sigmoid(transform)
+                if self.data_format == "NCHW":
+                    transform = tf.reshape(transform, [n, c, 1, 1])
                 return main_pipe + transform
 
         if self.config.is_train:
@@ -80,7 +156,7 @@ class Module:
     def shortcut(self, tensor_in, low_level, kernel_size, stride, out_depth, scope):
         with tf.variable_scope(scope):
             low_level = self.conv_block(low_level, kernel_size, stride, out_depth)
-            return tf.concat([tensor_in, low_level], 3)
+            return tf.concat([tensor_in, low_level], self.channel_axis())
 
     def upscale(self, tensor_in, fp_feature, kernel_size, stride, out_depth, scope):
         raise NotImplementedError("Full code will be shared in future")
@@ -88,7 +164,7 @@ class Module:
     def get_logit(self, tensor_in, kernel_size, stride):
         def build(main_pipe):
             kernel = self.get_kernel(main_pipe, kernel_size, self.num_classes)
-            main_pipe = tf.nn.conv2d(main_pipe, kernel, [1, stride, stride, 1], 'SAME')
+            main_pipe = tf.nn.conv2d(main_pipe, kernel, self.get_strides(stride), 'SAME', data_format=self.data_format)
             return main_pipe
 
         with tf.variable_scope('get_logit'):
@@ -0,0 +1,56 @@
+from functions.project_fn.frozen_model import FrozenModel
+from functions.project_fn.mask_codec import save_mask
+from functions.project_fn.utils import superimpose
+from cv2 import imread, imwrite
+import multiprocessing as mp
+import numpy as np
+import tensorflow as tf
+import os
+import time
+
+
+def _vis_worker(weights_path, img_list, vis_result_dir, cores, intra_op_threads, vis_output):
+    os.sched_setaffinity(0, cores)
+    session_config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads or len(cores),
+                                    inter_op_parallelism_threads=1)
+    # each worker parses its own copy of the weights into its own session
+    graph_def = tf.GraphDef()
+    with open(weights_path, "rb") as reader:
+        graph_def.ParseFromString(reader.read())
+    model = FrozenModel(graph_def, session_config)
+    start_time = time.time()
+    for img_name in img_list:
+        image = imread(img_name)
+        pred = model.run(np.expand_dims(image[:, :, ::-1], 0))[0]  # the network takes RGB and superimpose BGR
+        dst_name = os.path.join(vis_result_dir, os.path.basename(img_name))
+        if vis_output == "overlay":
+            imwrite(dst_name, superimpose(image, pred))
+        else:
+            save_mask(os.path.splitext(dst_name)[0] + ".npz", pred, vis_output)
+    model.close()
+    return len(img_list), time.time() - start_time
+
+
+def run_sharded_vis(weights_path, img_list, vis_result_dir, num_workers, intra_op_threads=None, vis_output="overlay"):
+    """
+    splits img_list across num_workers processes. each worker is pinned to its own slice of the cpu cores
+
+    weights_path: frozen graph loaded by every worker
+    """
+    cores = sorted(os.sched_getaffinity(0))
+    if num_workers > len(cores):
+        raise ValueError("num_workers (%d) exceeds the number of available cores (%d)" % (num_workers, len(cores)))
+    core_slices = [set(core_slice.tolist()) for core_slice in np.array_split(cores, num_workers)]
+    # interleaved shards balance folders whose image sizes change with the file order
+    shards = [img_list[index::num_workers] for index in range(num_workers)]
+
+    print("Visualizing %d images with %d workers..." % (len(img_list), num_workers))
+    start_time = time.time()
+    # tensorflow is not fork-safe once a session exists in the parent process
+    with mp.get_context("spawn").Pool(num_workers) as pool:
+        results = pool.starmap(_vis_worker, [(weights_path, shard, vis_result_dir, core_slice, intra_op_threads, vis_output)
+                                             for shard, core_slice in zip(shards, core_slices)])
+    elapsed = time.time() - start_time
+    for index, (num_images, worker_elapsed) in enumerate(results):
+        print("worker%d: %d images, %.2f images/sec" % (index, num_images, num_images / max(worker_elapsed, 1e-9)))
+    print("total: %.2f images/sec" % (len(img_list) / elapsed))
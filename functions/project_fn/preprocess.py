@@ -1,7 +1,4 @@
 from functions.project_fn.utils import get_shape as get_shape
-from scipy.ndimage.interpolation import map_coordinates
-from scipy.ndimage.filters import gaussian_filter
-import cv2 as cv
 import tensorflow as tf
 import numpy as np
 
@@ -241,6 +238,7 @@ class Preprocessing:
         draw_grid lines for visualizing how an image is manipuliated in data augmentation
 
         """
+        import cv2 as cv
         grid_size = int(im.shape[1] / grid_num)
         for i in range(0, im.shape[1], grid_size):
             cv.line(im, (i, 0), (i, im.shape[0]), color=(255,))
@@ -255,6 +253,7 @@ class Preprocessing:
         The function
 
         """
+        import cv2 as cv
         if not 0.0 < ratio <= 1.0:
             raise ValueError("warp ratio should be (0.0, 1.0]")
 
@@ -300,6 +299,10 @@ class Preprocessing:
 
          Based on https://gist.github.com/erniejunior/601cdf56d2b424757de5
         """
+        # imported here so that scipy is needed only when elastic distortion is active
+        from scipy.ndimage.interpolation import map_coordinates
+        from scipy.ndimage.filters import gaussian_filter
+        import cv2 as cv
         if np.random.rand() <= prob:
             random_state = np.random.RandomState(None)
             # scale up 4 times just in case seg has very thin line of labels
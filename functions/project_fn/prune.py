@@ -0,0 +1,142 @@
+from collections import defaultdict
+import numpy as np
+import tensorflow as tf
+
+# ops between a variable and the kernel input of a conv. fp16 models read their fp32 variables through a cast
+VARIABLE_READ_OPS = ["Identity", "Cast", "ReadVariableOp"]
+# ops reading only the shape of a tensor, e.g. get_shape on inputs of dynamic size. their values need no slicing
+# because the pruned model is rebuilt from its architecture
+SHAPE_OPS = ["Shape", "ShapeN", "Rank", "Size"]
+
+
+def variable_name(tensor):
+    op = tensor.op
+    while op.type in VARIABLE_READ_OPS:
+        op = op.inputs[0].op
+    if op.type not in ["VarHandleOp", "VariableV2"]:
+        return None
+    return op.name
+
+
+def _trace_consumers(tensor, offset, channel_axis, consumers):
+    """
+    collects (variable name, input channel axis, offset) of the kernels reading the channels of tensor.
+    channel c of tensor is input channel offset + c of the kernel. it reaches kernels through concats of shortcut
+
+    returns False if the channels reach an op whose channels can not be sliced, e.g. gc_block or a residual add
+    """
+    for op in tensor.consumers():
+        if op.type in SHAPE_OPS:
+            is_safe = True
+        elif op.type == "Identity":
+            is_safe = _trace_consumers(op.outputs[0], offset, channel_axis, consumers)
+        elif op.type == "ConcatV2" and tf.get_static_value(op.inputs[-1]) % 4 == channel_axis:
+            is_safe = True
+            concat_offset = offset
+            for concat_input in op.inputs[:-1]:
+                if concat_input.name == tensor.name:
+                    is_safe = is_safe and _trace_consumers(op.outputs[0], concat_offset, channel_axis, consumers)
+                concat_offset += concat_input.get_shape().as_list()[channel_axis]
+        elif op.type in ["Conv2D", "DepthwiseConv2dNative"] and op.inputs[0].name == tensor.name:
+            kernel = variable_name(op.inputs[1])
+            consumers.append((kernel, 2, offset))
+            is_safe = kernel is not None
+            if op.type == "DepthwiseConv2dNative":
+                # a depthwise conv keeps the channels. the pointwise conv of separable_conv_block follows it
+                is_safe = is_safe and _trace_consumers(op.outputs[0], offset, channel_axis, consumers)
+        elif op.type == "Conv2DBackpropInput" and op.inputs[2].name == tensor.name:
+            # kernels of transpose_conv_block are [height, width, out, in]
+            kernel = variable_name(op.inputs[1])
+            consumers.append((kernel, 3, offset))
+            is_safe = kernel is not None
+        else:
+            is_safe = False
+        if not is_safe:
+            return False
+    return True
+
+
+def find_conv_blocks(graph, channel_axis):
+    """
+    finds conv -> batch norm -> elu of conv_block and its efficient variants in an inference graph
+
+    returns {variable scope of conv_block: block}. block["prunable"] is False if the output channels can not be removed
+    without changing ops other than kernels and batch norms
+    """
+    blocks = dict()
+    for op in graph.get_operations():
+        if not op.type.startswith("FusedBatchNorm") or op.inputs[0].op.type != "Conv2D":
+            continue
+        conv = op.inputs[0].op
+        kernel = variable_name(conv.inputs[1])
+        consumers = []
+        activations = op.outputs[0].consumers()
+        is_prunable = len(activations) == 1 and activations[0].type == "Elu" and \
+            _trace_consumers(activations[0].outputs[0], 0, channel_axis, consumers)
+        blocks[kernel.rsplit("/", 1)[0]] = {"kernel": kernel,
+                                            "batch_norm": [variable_name(tensor) for tensor in op.inputs[1:5]],  # gamma, beta, mean, variance
+                                            "out_depth": conv.inputs[1].get_shape().as_list()[3],
+                                            "consumers": consumers,
+                                            "prunable": is_prunable}
+    return blocks
+
+
+def select_channels(blocks, gammas, prune_ratio, min_keep_ratio):
+    """
+    ranks the channels of all prunable blocks together by |gamma| and removes the lowest prune_ratio of them.
+    at least min_keep_ratio of the channels of each block are kept
+
+    returns {variable scope: sorted indices of the kept channels}
+    """
+    if not 0 <= prune_ratio < 1:
+        raise ValueError("prune_ratio must be in [0, 1): %s" % prune_ratio)
+    prunable = [scope for scope, block in blocks.items() if block["prunable"]]
+    if not prunable:
+        raise ValueError("No prunable conv_block is found")
+    magnitudes = np.sort(np.concatenate([np.abs(gammas[scope]) for scope in prunable]))
+    threshold = magnitudes[int(len(magnitudes) * prune_ratio)]
+    kept_channels = dict()
+    for scope, block in blocks.items():
+        if scope not in prunable:
+            kept_channels[scope] = np.arange(block["out_depth"])
+            continue
+        magnitude = np.abs(gammas[scope])
+        num_kept = max(np.sum(magnitude >= threshold), int(np.ceil(len(magnitude) * min_keep_ratio)), 1)
+        kept_channels[scope] = np.sort(np.argsort(-magnitude)[:num_kept])
+    return kept_channels
+
+
+def prune_variables(reader, var_names, blocks, kept_channels):
+    """
+    slices the kernels and batch norms of the blocks and the input channels of the kernels reading them
+
+    reader: checkpoint reader of the original model
+    var_names: names of the variables to be written
+    returns {variable name: pruned array}
+    """
+    removed = defaultdict(lambda: defaultdict(set))  # variable name -> axis -> removed indices
+    for scope, block in blocks.items():
+        removed_channels = np.setdiff1d(np.arange(block["out_depth"]), kept_channels[scope])
+        if not len(removed_channels):
+            continue
+        removed[block["kernel"]][3].update(removed_channels)
+        for name in block["batch_norm"]:
+            removed[name][0].update(removed_channels)
+        for name, axis, offset in block["consumers"]:
+            removed[name][axis].update(removed_channels + offset)
+    values = dict()
+    for name in var_names:
+        value = reader.get_tensor(name)
+        for axis, indices in removed[name].items():
+            value = np.delete(value, sorted(indices), axis)
+        values[name] = value
+    return values
+
+
+def save_variables(values, ckpt_path):
+    graph = tf.Graph()
+    with graph.as_default():
+        saver = tf.train.Saver({name: tf.Variable(value) for name, value in values.items()})
+        with tf.Session(graph=graph) as sess:
+            sess.run(tf.global_variables_initializer())
+            saver.save(sess, ckpt_path, write_meta_graph=False)
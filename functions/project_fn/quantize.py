@@ -0,0 +1,126 @@
+from functions.project_fn.frozen_model import FrozenModel, INPUT_NODE
+from functions.project_fn.model_handler import EvalHandler
+from functions.project_fn.utils import list_getter, imread_rgb
+from cv2 import copyMakeBorder, BORDER_REFLECT_101
+import numpy as np
+import tensorflow as tf
+import os
+
+
+def tile_predict(run_fn, image, tile_h, tile_w):
+    """
+    runs a fixed input size model over an image of any size tile by tile and stitches the predictions
+
+    run_fn: a function taking a uint8 array of [1, tile_h, tile_w, 3] and returning a prediction of [1, tile_h, tile_w]
+    image: uint8 RGB array of [height, width, 3]
+    """
+    h, w, _ = image.shape
+    pad_h = -h % tile_h
+    pad_w = -w % tile_w
+    if pad_h or pad_w:
+        image = copyMakeBorder(image, 0, pad_h, 0, pad_w, BORDER_REFLECT_101)
+    pred = np.empty(image.shape[:2], np.uint8)
+    for y in range(0, h + pad_h, tile_h):
+        for x in range(0, w + pad_w, tile_w):
+            tile = np.expand_dims(image[y:y + tile_h, x:x + tile_w], 0)
+            pred[y:y + tile_h, x:x + tile_w] = run_fn(tile)[0]
+    return pred[:h, :w]
+
+
+class Quantizer(EvalHandler):
+    """
+    post-training int8 quantization of a frozen graph written by phase=export.
+    activation ranges are calibrated on the eval set. the int8 model is compared with an fp32 tflite model of the same
+    converter, so the speedup is measured in the same runtime, and with the fp32 frozen graph for accuracy
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.frozen_graph = os.path.join(self.config.export_dir, "model_step-%d.pb" % self.config.ckpt_id)
+        self.fp32_model = FrozenModel(self.frozen_graph)
+        input_shape = self.fp32_model.input_data.get_shape().as_list()
+        if None in input_shape:
+            raise ValueError("int8 quantization needs a frozen graph exported with a fixed input_size")
+        self.input_shape = input_shape
+        self.img_list = list_getter(self.config.img_dir, "jpg")[::self.config.img_step]
+        self.gt_list = list_getter(self.config.seg_dir, "png")[::self.config.img_step]
+        if not len(self.img_list) == len(self.gt_list):
+            raise ValueError("number of images are different")
+        self._quantize()
+
+    def _representative_dataset(self):
+        _, tile_h, tile_w, _ = self.input_shape
+        calibration_list = self.img_list[:self.config.calibration_num]
+        for img_name in calibration_list:
+            image = imread_rgb(img_name)
+            h, w, _ = image.shape
+            # a random tile of each image keeps the calibration inputs at the exported input size
+            y = np.random.randint(0, max(h - tile_h, 0) + 1)
+            x = np.random.randint(0, max(w - tile_w, 0) + 1)
+            tile = image[y:y + tile_h, x:x + tile_w]
+            if tile.shape[:2] != (tile_h, tile_w):
+                tile = copyMakeBorder(tile, 0, tile_h - tile.shape[0], 0, tile_w - tile.shape[1], BORDER_REFLECT_101)
+            yield [np.expand_dims(tile, 0)]
+
+    def _convert(self, is_int8):
+        converter = tf.lite.TFLiteConverter.from_frozen_graph(self.frozen_graph,
+                                                              [INPUT_NODE],
+                                                              ["prob"],
+                                                              {INPUT_NODE: self.input_shape})
+        if is_int8:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = self._representative_dataset
+            if self.config.int8_only:
+                converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        return converter.convert()
+
+    @staticmethod
+    def _get_tflite_run_fn(tflite_model):
+        # fp32 and int8 models run in interpreters built the same way, so both use the same thread count
+        interpreter = tf.lite.Interpreter(model_content=tflite_model)
+        interpreter.allocate_tensors()
+        input_index = interpreter.get_input_details()[0]["index"]
+        output_index = interpreter.get_output_details()[0]["index"]
+
+        def run_fn(tile):
+            interpreter.set_tensor(input_index, tile)
+            interpreter.invoke()
+            return np.argmax(interpreter.get_tensor(output_index), 3)
+
+        return run_fn
+
+    def _evaluate(self, run_fn):
+        _, tile_h, tile_w, _ = self.input_shape
+        self.cumulative_cmatrix, sec_per_image = self._evaluate_files(lambda image: tile_predict(run_fn, image, tile_h, tile_w),
+                                                                      self.img_list, self.gt_list)
+        self._calculate_segmentation_metric()
+        return sec_per_image, self.metrics
+
+    def _write_report(self, rows):
+        metric_names = ["precision", "recall", "f1", "miou"] if self.config.num_classes <= 2 else ["miou"]
+        with open(os.path.join(self.config.export_dir, "quantization_report.csv"), "w") as writer:
+            writer.write("model, sec/image, " + ", ".join(metric_names) + "\n")
+            for name, latency, metrics in rows:
+                writer.write("%s, %s, " % (name, latency) + ", ".join([str(value) for value in metrics]) + "\n")
+
+    def _quantize(self):
+        print("Calibrating activation ranges on %d images..." % min(len(self.img_list), self.config.calibration_num))
+        tflite_model = self._convert(True)
+        tflite_path = os.path.splitext(self.frozen_graph)[0] + ".int8.tflite"
+        with open(tflite_path, "wb") as writer:
+            writer.write(tflite_model)
+        print("int8 model is saved: %s" % tflite_path)
+
+        fp32_latency, fp32_metrics = self._evaluate(lambda tile: self.fp32_model.run(tile))
+        self.fp32_model.close()
+        fp32_tflite_latency, fp32_tflite_metrics = self._evaluate(self._get_tflite_run_fn(self._convert(False)))
+        int8_latency, int8_metrics = self._evaluate(self._get_tflite_run_fn(tflite_model))
+        self._write_report([["fp32", fp32_latency, fp32_metrics],
+                            ["fp32-tflite", fp32_tflite_latency, fp32_tflite_metrics],
+                            ["int8", int8_latency, int8_metrics],
+                            ["int8-fp32", int8_latency - fp32_tflite_latency, np.subtract(int8_metrics, fp32_metrics)]])
+        print("fp32: %.4f sec/image (tensorflow), %.4f sec/image (tflite)" % (fp32_latency, fp32_tflite_latency))
+        print("int8: %.4f sec/image (tflite), speedup over fp32 tflite=%.2fx" % (int8_latency, fp32_tflite_latency / int8_latency))
+        print("mIoU change: %+.5f" % (int8_metrics[-1] - fp32_metrics[-1]))
+        if self.config.num_classes <= 2:
+            print("F1 change: %+.5f" % (int8_metrics[2] - fp32_metrics[2]))
@@ -0,0 +1,64 @@
+import cv2 as cv
+import numpy as np
+
+
+class RoiInference:
+    """
+    coarse-to-fine inference for large images.
+    a downscaled pass marks candidate crack regions, then only the tiles overlapping the candidates are run at
+    full resolution. the rest of the mask is background
+
+    prob_fn: runs the network on uint8 RGB images of [batch, height, width, 3] and returns crack probabilities of
+             [batch, height, width]
+    """
+
+    def __init__(self, config, prob_fn):
+        if not config.num_classes == 2:
+            raise ValueError("roi_inference works only if num_classes is 2")
+        self.config = config
+        self.prob_fn = prob_fn
+        self.num_pixels = 0
+        self.num_skipped_pixels = 0
+
+    def _candidate_tiles(self, image):
+        h, w, _ = image.shape
+        tile = self.config.roi_tile_size
+        scale = self.config.roi_scale
+        small = cv.resize(image, (max(int(w * scale), 1), max(int(h * scale), 1)), interpolation=cv.INTER_AREA)
+        coarse_prob = self.prob_fn(np.expand_dims(small, 0))[0]
+        # a low threshold and a margin of neighbouring tiles keep the recall of the coarse pass high
+        candidate = cv.resize(coarse_prob, (w, h), interpolation=cv.INTER_LINEAR) > self.config.roi_threshold
+        grid_h, grid_w = -(-h // tile), -(-w // tile)
+        candidate = np.pad(candidate, [[0, grid_h * tile - h], [0, grid_w * tile - w]])
+        tiles = candidate.reshape(grid_h, tile, grid_w, tile).any(axis=(1, 3)).astype(np.uint8)
+        if self.config.roi_margin:
+            tiles = cv.dilate(tiles, np.ones((2 * self.config.roi_margin + 1,) * 2, np.uint8))
+        return np.argwhere(tiles)
+
+    def predict(self, image):
+        """
+        image: uint8 RGB array of [height, width, 3]
+        returns: prediction of [height, width]
+        """
+        h, w, _ = image.shape
+        tile = self.config.roi_tile_size
+        context = self.config.roi_context
+        selected = self._candidate_tiles(image)
+        grid_h, grid_w = -(-h // tile), -(-w // tile)
+        # every tile is run with a border of context pixels so that the network sees its surroundings
+        padded = cv.copyMakeBorder(image, context, grid_h * tile - h + context, context, grid_w * tile - w + context,
+                                   cv.BORDER_REFLECT_101)
+        pred = np.zeros((grid_h * tile, grid_w * tile), np.uint8)
+        for start in range(0, len(selected), self.config.roi_batch_size):
+            batch_index = selected[start:start + self.config.roi_batch_size]
+            batch = np.stack([padded[y * tile:(y + 1) * tile + 2 * context, x * tile:(x + 1) * tile + 2 * context]
+                              for y, x in batch_index], 0)
+            prob = self.prob_fn(batch)[:, context:context + tile, context:context + tile]
+            for (y, x), tile_prob in zip(batch_index, prob):
+                pred[y * tile:(y + 1) * tile, x * tile:(x + 1) * tile] = tile_prob > 0.5
+        self.num_pixels += h * w
+        self.num_skipped_pixels += max(h * w - len(selected) * tile * tile, 0)
+        return pred[:h, :w]
+
+    def skipped_ratio(self):
+        return self.num_skipped_pixels / max(self.num_pixels, 1)
@@ -0,0 +1,180 @@
+from functions.project_fn.frozen_model import FrozenModel
+from functions.project_fn.mask_codec import rle_encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from cv2 import imdecode, IMREAD_COLOR
+import numpy as np
+import threading
+import queue
+import json
+import os
+import time
+
+
+class LatencyHistogram:
+    """
+    thread-safe latency histogram with fixed bucket bounds in milliseconds
+    """
+    bounds = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf")]
+
+    def __init__(self):
+        self.counts = [0] * len(self.bounds)
+        self.total = 0.0
+        self.num = 0
+        self.lock = threading.Lock()
+
+    def add(self, latency_ms):
+        index = next(i for i, bound in enumerate(self.bounds) if latency_ms <= bound)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += latency_ms
+            self.num += 1
+
+    def summary(self):
+        with self.lock:
+            return {"buckets_ms": [str(bound) for bound in self.bounds],
+                    "counts": list(self.counts),
+                    "num": self.num,
+                    "mean_ms": self.total / self.num if self.num else 0.0}
+
+
+class _Request:
+    def __init__(self, image):
+        self.image = image
+        self.arrival = time.time()
+        self.done = threading.Event()
+        self.pred = None
+        self.error = None
+        self.queue_ms = None
+
+
+class InferenceServer:
+    """
+    local http inference service.
+    concurrent requests are collected into dynamic batches of images with the same size. a batch is run when
+    it reaches max_batch_size or when its first request has waited max_latency_ms
+
+    POST /segment: body is an encoded jpg/png image. returns {"height", "width", "rle", "queue_ms", "latency_ms"}.
+                   400 if the image can not be decoded or does not fit the input size of the graph, 500 if inference fails
+    GET /metrics: returns latency histograms and the batch size distribution
+    """
+
+    def __init__(self, config):
+        self.config = config
+        frozen_graph = os.path.join(self.config.export_dir, "model_step-%d.pb" % self.config.ckpt_id)
+        self.model = FrozenModel(frozen_graph)
+        if self.config.max_batch_size > 1 and self.model.input_data.get_shape().as_list()[0] is not None:
+            raise ValueError("dynamic batching needs a frozen graph exported with input_size=None")
+        self.input_size = self.model.input_data.get_shape().as_list()[1:3]  # [None, None] for any image size
+        self.requests = queue.Queue()
+        self.histograms = {"queue": LatencyHistogram(), "inference": LatencyHistogram(), "total": LatencyHistogram()}
+        self.batch_sizes = [0] * (self.config.max_batch_size + 1)
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+
+    def _collect_batch(self):
+        batch = [self.requests.get()]
+        deadline = batch[0].arrival + self.config.max_latency_ms / 1000.0
+        while len(batch) < self.config.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self):
+        while True:
+            batch = self._collect_batch()
+            groups = dict()
+            for request in batch:
+                groups.setdefault(request.image.shape, []).append(request)
+            for group in groups.values():
+                # a failure is reported to the requests of its group only. the loop keeps serving the others
+                start_time = time.time()
+                try:
+                    preds = self.model.run(np.stack([request.image for request in group], 0))
+                except Exception as error:
+                    for request in group:
+                        request.error = error
+                        request.done.set()
+                    continue
+                inference_ms = (time.time() - start_time) * 1000.0
+                self.batch_sizes[len(group)] += 1
+                for request, pred in zip(group, preds):
+                    request.queue_ms = (start_time - request.arrival) * 1000.0
+                    request.pred = pred
+                    self.histograms["queue"].add(request.queue_ms)
+                    self.histograms["inference"].add(inference_ms)
+                    request.done.set()
+
+    def segment(self, image):
+        for length, input_length in zip(image.shape[:2], self.input_size):
+            if input_length is not None and length != input_length:
+                raise ValueError("The graph takes %s images, not %dx%d" % ("x".join(map(str, self.input_size)), *image.shape[:2]))
+        request = _Request(image)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise RuntimeError("Inference failed: %s" % request.error)
+        latency_ms = (time.time() - request.arrival) * 1000.0
+        self.histograms["total"].add(latency_ms)
+        h, w = request.pred.shape
+        return {"height": h, "width": w, "rle": rle_encode(request.pred).tolist(),
+                "queue_ms": request.queue_ms, "latency_ms": latency_ms}
+
+    def metrics(self):
+        metrics = {name: histogram.summary() for name, histogram in self.histograms.items()}
+        metrics["batch_size_counts"] = self.batch_sizes
+        return metrics
+
+    def _get_request_handler(self):
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def _reply(self, code, body):
+                body = json.dumps(body).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/metrics":
+                    self._reply(200, server.metrics())
+                else:
+                    self._reply(404, {"error": "unknown path: %s" % self.path})
+
+            def do_POST(self):
+                if not self.path == "/segment":
+                    self._reply(404, {"error": "unknown path: %s" % self.path})
+                    return
+                data = self.rfile.read(int(self.headers["Content-Length"]))
+                image = imdecode(np.frombuffer(data, np.uint8), IMREAD_COLOR)
+                if image is None:
+                    self._reply(400, {"error": "image cannot be decoded"})
+                    return
+                try:
+                    result = server.segment(image[:, :, ::-1])  # imdecode returns BGR. the network takes RGB
+                except ValueError as error:
+                    self._reply(400, {"error": str(error)})
+                    return
+                except RuntimeError as error:
+                    self._reply(500, {"error": str(error)})
+                    return
+                self._reply(200, result)
+
+            def log_message(self, format, *args):
+                pass
+
+        return RequestHandler
+
+    def serve_forever(self):
+        httpd = ThreadingHTTPServer((self.config.host, self.config.port), self._get_request_handler())
+        print("Serving on http://%s:%d" % (self.config.host, self.config.port))
+        try:
+            httpd.serve_forever()
+        finally:
+            httpd.server_close()
+            self.model.close()
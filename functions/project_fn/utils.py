@@ -1,5 +1,6 @@
 from tensorflow import unstack
 from tensorflow import shape
+from functions.project_fn.manifest import scan_tree
 import os
 import re
 
@@ -19,13 +20,33 @@ def list_getter(dir_name, extension, must_include=None):
 
     file_list = []
     if dir_name:
-        for path, subdirs, files in os.walk(dir_name):
-            for name in files:
-                if name.lower().endswith((extension)):
-                    if must_include:
-                        if must_include in name:
-                            file_list.append(os.path.join(path, name))
-                    else:
-                        file_list.append(os.path.join(path, name))
+        # the listing of each directory is cached and rescanned only if it has changed. see manifest.py
+        for file_path in scan_tree(dir_name):
+            name = os.path.basename(file_path)
+            if name.lower().endswith((extension)):
+                if must_include:
+                    if must_include in name:
+                        file_list.append(file_path)
+                else:
+                    file_list.append(file_path)
         sort_nicely(file_list)
     return file_list
+
+
+def imread_rgb(img_name):
+    """
+    reads an image file as a uint8 RGB array of [height, width, 3], the channel order of decode_png in DataPipeline
+    """
+    from cv2 import imread
+    return imread(img_name)[:, :, ::-1]
+
+
+def superimpose(image, pred):
+    """
+    paints crack pixels red in place
+
+    image: uint8 BGR image of [height, width, 3]. it is modified and returned
+    pred: prediction of [height, width]
+    """
+    image[pred != 0] = (0, 0, 255)
+    return image
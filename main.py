@@ -1,13 +1,36 @@
 from functions.project_fn.deploy_config import deploy
-from functions.project_fn.data_pipeline import DataPipeline
-from functions.project_fn.model_handler import ModelHandler
 import argparse
+import time
 
-argparser = argparse.ArgumentParser()
-argparser.add_argument('--phase', type=str, default='train', help='options: train, eval, vis')
-args = argparser.parse_args()
+# guarded so that spawned worker processes, e.g. of phase=vis with num_workers > 1, do not rerun the phase
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--phase', type=str, default='train', help='options: train, eval, vis, export, prune, quantize, serve')
+    argparser.add_argument('--autotune', action='store_true', help='benchmark parallelism settings of the phase and save them for this host')
+    args = argparser.parse_args()
 
-config = deploy(args)
+    start_time = time.time()
+    config = deploy(args)
+    print("startup: deploy %.2f sec" % (time.time() - start_time))
 
-data_pipeline = DataPipeline(config)
-ModelHandler(data_pipeline, config)
+    # each phase imports only what it needs. e.g. horovod is imported by train and scipy by elastic distortion
+    start_time = time.time()
+    if args.autotune:
+        from functions.project_fn.autotune import autotune
+        autotune(config)
+    elif config.phase == "quantize":
+        from functions.project_fn.quantize import Quantizer
+        print("startup: import %.2f sec" % (time.time() - start_time))
+        Quantizer(config)
+    elif config.phase == "serve":
+        from functions.project_fn.server import InferenceServer
+        print("startup: import %.2f sec" % (time.time() - start_time))
+        InferenceServer(config).serve_forever()
+    else:
+        from functions.project_fn.data_pipeline import DataPipeline
+        from functions.project_fn.model_handler import ModelHandler
+        print("startup: import %.2f sec" % (time.time() - start_time))
+        start_time = time.time()
+        data_pipeline = DataPipeline(config)
+        print("startup: data pipeline %.2f sec" % (time.time() - start_time))
+        ModelHandler(data_pipeline, config)